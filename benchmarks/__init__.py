@@ -0,0 +1,10 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+# Benchmarks run from the repository root, e.g. python -m benchmarks.ingest. The
+# collector imports its constants by module name, as in its container. Without
+# DATABASE_URL a new SQLite database is used
+sys.path.insert(0, str(Path(__file__).parents[1] / "src" / "weatherman" / "collector"))
+os.environ.setdefault("DATABASE_URL", f"sqlite:///{tempfile.mkdtemp()}/weather.db")
@@ -0,0 +1,56 @@
+import argparse
+import json
+import time
+from pathlib import Path
+
+from src.weatherman.collector import schema
+
+# A 3 day forecast.json answer in the layout weatherapi.com sends, with every field
+# of the API, including the ones the collector does not store
+RESPONSE = Path(__file__).with_name("forecast.json")
+
+
+def rows(raw):
+    # The rows ingest builds from a response, without ids
+    data = schema.weather_decoder.decode(raw)
+    built = [schema.CURRENT_WEATHER.row(data.current)]
+    for forecast_data in data.forecast.forecastday:
+        schema.parse_date(forecast_data.date)
+        built.append(schema.DAILY.row(forecast_data.day))
+        built.append(schema.ASTRO.row(forecast_data.astro))
+        built.extend(schema.HOURLY.row(hour_data) for hour_data in forecast_data.hour)
+    return built
+
+
+def measure(name, function, raw, repeat):
+    function(raw)
+    started = time.perf_counter()
+    for _ in range(repeat):
+        function(raw)
+    elapsed = time.perf_counter() - started
+    print(
+        f"{name:>20}: {elapsed / repeat * 1e6:7.0f} us/response, "
+        f"{repeat / elapsed:7.0f} responses/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure decoding of a forecast response into database rows"
+    )
+    parser.add_argument(
+        "--response", type=Path, default=RESPONSE, help="Forecast response to decode"
+    )
+    parser.add_argument("--repeat", type=int, default=2000)
+    args = parser.parse_args()
+
+    raw = args.response.read_bytes()
+    days = len(schema.weather_decoder.decode(raw).forecast.forecastday)
+    print(f"{len(raw)} byte response with {days} forecast days")
+    measure("json.loads", json.loads, raw, args.repeat)
+    measure("decode", schema.weather_decoder.decode, raw, args.repeat)
+    measure("decode and rows", rows, raw, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
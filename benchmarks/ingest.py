@@ -0,0 +1,72 @@
+import argparse
+import logging
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+
+import msgspec
+
+from src.weatherman.db import engine
+from src.weatherman.migrations import migrate
+from src.weatherman.collector import schema
+from src.weatherman.collector.weatherapi import save_many_from_json
+import src.weatherman.collector.cache as cache
+from tests.payloads import response
+
+
+def decoded_responses(count, locations, days):
+    # Each location once an hour, so every response brings new current weather
+    started = datetime(2026, 1, 1, 12, 15)
+    return [
+        schema.weather_decoder.decode(
+            msgspec.json.encode(
+                response(
+                    f"Location {n % locations}",
+                    started + timedelta(hours=n // locations),
+                    days,
+                    seed=n,
+                )
+            )
+        )
+        for n in range(count)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure how fast weather responses are written to the database"
+    )
+    parser.add_argument("--responses", type=int, default=200)
+    parser.add_argument("--locations", type=int, default=20)
+    parser.add_argument("--days", type=int, default=3, help="Forecast days each")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Responses per transaction, 1 writes every response on its own",
+    )
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    migrate(engine)
+    cache.conditions.load()
+    cache.locations.load()
+    responses = decoded_responses(args.responses, args.locations, args.days)
+    written = Counter()
+    started = time.perf_counter()
+    for start in range(0, len(responses), args.batch_size):
+        rows_written, _ = save_many_from_json(
+            responses[start : start + args.batch_size]
+        )
+        written.update(rows_written)
+    elapsed = time.perf_counter() - started
+    rows = sum(written.values())
+    print(
+        f"{engine.dialect.name}: {len(responses)} responses in batches of "
+        f"{args.batch_size}, {rows} rows in {elapsed:.2f}s, {rows / elapsed:.0f} rows/s, "
+        f"{len(responses) / elapsed:.1f} responses/s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+import argparse
+import asyncio
+import os
+import random
+import time
+
+import httpx
+
+
+async def login(client, username, password):
+    response = await client.post(
+        "/token", data={"username": username, "password": password}
+    )
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def run_clients(client, headers, args, clients):
+    # Every client sends its next request as soon as the previous one is answered.
+    # With --etag the clients share the ETags they got, like polling clients that
+    # repeat them in If-None-Match
+    latencies = []
+    etags = {}
+    not_modified = 0
+    deadline = time.perf_counter() + args.seconds
+
+    async def run_client():
+        nonlocal not_modified
+        while time.perf_counter() < deadline:
+            location_id = random.randint(1, args.locations)
+            request_headers = headers
+            if location_id in etags:
+                request_headers = headers | {"If-None-Match": etags[location_id]}
+            started = time.perf_counter()
+            response = await client.get(
+                f"/api/v1/weather/{args.endpoint}/{location_id}",
+                headers=request_headers,
+            )
+            if response.status_code == 304:
+                not_modified += 1
+            elif response.status_code != 200:
+                raise RuntimeError(
+                    f"{response.status_code} for location {location_id}: "
+                    f"{response.text}"
+                )
+            latencies.append(time.perf_counter() - started)
+            if args.etag and "ETag" in response.headers:
+                etags[location_id] = response.headers["ETag"]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(run_client() for _ in range(clients)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    print(
+        f"clients={clients:3d} {len(latencies) / elapsed:8.1f} req/s  "
+        f"p50={latencies[len(latencies) // 2] * 1000:6.1f} ms  "
+        f"p99={latencies[int(len(latencies) * 0.99)] * 1000:6.1f} ms  "
+        f"304={not_modified / len(latencies):.0%}"
+    )
+
+
+async def load(args):
+    async with httpx.AsyncClient(
+        base_url=args.url,
+        timeout=60,
+        limits=httpx.Limits(max_connections=max(args.clients)),
+    ) as client:
+        headers = await login(client, args.username, args.password)
+        for clients in args.clients:
+            await run_clients(client, headers, args, clients)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure API throughput with a growing number of clients"
+    )
+    parser.add_argument("url", help="API base URL, e.g. http://127.0.0.1:5000")
+    parser.add_argument("--clients", type=int, nargs="+", default=[1, 4, 16, 64])
+    parser.add_argument("--seconds", type=float, default=5, help="Per client count")
+    parser.add_argument(
+        "--endpoint",
+        choices=["latest_current", "forecast_daily"],
+        default="latest_current",
+    )
+    parser.add_argument(
+        "--locations",
+        type=int,
+        default=20,
+        help="Location ids are picked from 1 to this, all need data",
+    )
+    parser.add_argument(
+        "--etag",
+        action="store_true",
+        help="Send the last ETag of each location in If-None-Match",
+    )
+    parser.add_argument("--username", default="admin")
+    parser.add_argument("--password", default=os.getenv("DEFAULT_ADMIN_PASSWORD"))
+    args = parser.parse_args()
+    asyncio.run(load(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+import argparse
+import logging
+import multiprocessing
+import random
+import time
+
+from sqlalchemy import func, select
+from sqlalchemy.exc import OperationalError
+
+from src.weatherman.db import engine
+from src.weatherman.migrations import migrate
+from src.weatherman.ormodels import Forecast, Hourly
+from src.weatherman.api import queries
+from src.weatherman.collector.weatherapi import save_many_from_json
+import src.weatherman.collector.cache as cache
+from benchmarks.ingest import decoded_responses
+
+
+def latest_weather(connection, location_id):
+    # The queries behind the API's latest_current and forecast_daily for one location
+    connection.execute(queries.latest_current([location_id])).all()
+    connection.execute(queries.latest_forecast([location_id])).all()
+
+
+def average_temperatures(connection, location_id):
+    # A long read over all hourly rows, streamed like an export
+    for _ in connection.execution_options(stream_results=True).execute(
+        select(Forecast.location_id, func.avg(Hourly.temp_c), func.count())
+        .join(Forecast, Forecast.id == Hourly.forecast_id)
+        .group_by(Forecast.location_id)
+    ):
+        pass
+
+
+READS = {"reader": latest_weather, "scan": average_temperatures}
+
+
+def read(kind, locations, stop, results):
+    # Runs in its own process, like the API next to the collector
+    logging.disable(logging.WARNING)
+    latencies = []
+    errors = 0
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            with engine.connect() as connection:
+                READS[kind](connection, random.randint(1, locations))
+        except OperationalError:
+            errors += 1
+        latencies.append(time.perf_counter() - started)
+    latencies.sort()
+    results.put(
+        f"{kind}: {len(latencies)} reads, "
+        f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, "
+        f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms, "
+        f"max {latencies[-1] * 1000:.0f} ms, {errors} failed"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure collector writes and API reads running side by side"
+    )
+    parser.add_argument("--locations", type=int, default=500)
+    parser.add_argument("--batches", type=int, default=40)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--readers", type=int, default=2)
+    parser.add_argument("--scans", type=int, default=1)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+
+    migrate(engine)
+    cache.conditions.load()
+    cache.locations.load()
+    # Every location is stored once before the readers start
+    save_many_from_json(decoded_responses(args.locations, args.locations, 3))
+    responses = decoded_responses(args.batches * args.batch_size, args.locations, 3)[
+        args.locations :
+    ]
+
+    context = multiprocessing.get_context("spawn")
+    stop = context.Event()
+    results = context.Queue()
+    readers = [
+        context.Process(target=read, args=(kind, args.locations, stop, results))
+        for kind, count in (("reader", args.readers), ("scan", args.scans))
+        for _ in range(count)
+    ]
+    for reader in readers:
+        reader.start()
+    time.sleep(1)
+
+    failed = 0
+    started = time.perf_counter()
+    for start in range(0, len(responses), args.batch_size):
+        try:
+            save_many_from_json(responses[start : start + args.batch_size])
+        except OperationalError:
+            failed += 1
+    elapsed = time.perf_counter() - started
+    stop.set()
+    print(
+        f"{engine.dialect.name} writer: {len(responses)} responses in {elapsed:.2f}s, "
+        f"{len(responses) / elapsed:.0f} responses/s, {failed} batches failed"
+    )
+    for reader in readers:
+        print(results.get())
+    for reader in readers:
+        reader.join()
+
+
+if __name__ == "__main__":
+    main()
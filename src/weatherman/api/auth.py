@@ -1,17 +1,20 @@
 import logging
+import math
 import os
 from datetime import datetime, timedelta, timezone
 from typing import Annotated
 
 from sqlalchemy import Select
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from .models import Token, TokenData, User
 import jwt
-from fastapi import Depends, APIRouter, HTTPException, status
+from fastapi import Depends, APIRouter, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from jwt.exceptions import InvalidTokenError
-from passlib.context import CryptContext
+from .cache import users
+from .passwords import PasswordPoolFull, pool, pwd_context
+from .throttle import LOGIN_REJECTIONS, addresses, usernames
 from .database import get_auth_db
 from .authschemas import UserSchema as UserSchema
 from .constants import JWT_ALGORITHM, JWT_ACCESS_TOKEN_EXPIRATION_MINUTES
@@ -24,14 +27,9 @@ if SECRET_KEY is None:
     print("API_SECRET_KEY environment variable not set")
     exit(1)
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-
 def get_password_hash(password):
     return pwd_context.hash(password)
 
@@ -47,26 +45,31 @@ def create_access_token(data: dict, expires_delta: timedelta | None = None):
     return encoded_jwt
 
 
-def get_user(username: str, db: Session = Depends(get_auth_db)):
+async def get_user(username: str, db: AsyncSession = Depends(get_auth_db)):
     select = Select(UserSchema).where(UserSchema.username == username)
-    user = db.execute(select).fetchone()
+    user = (await db.execute(select)).fetchone()
     if user:
         return User.model_validate(user[0])
     return None
 
 
-def authenticate_user(username: str, password: str, db: Session = Depends(get_auth_db)):
+async def authenticate_user(
+    username: str, password: str, db: AsyncSession = Depends(get_auth_db)
+):
     logger.debug(f"Authenticating user: {username}")
-    user = get_user(username=username, db=db)
+    user = await get_user(username=username, db=db)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    # Give the connection back to the pool while the password is checked
+    await db.close()
+    if not await pool.verify(password, user.hashed_password):
         return False
     return user
 
 
 async def get_current_user(
-    token: Annotated[str, Depends(oauth2_scheme)], db: Session = Depends(get_auth_db)
+    token: Annotated[str, Depends(oauth2_scheme)],
+    db: AsyncSession = Depends(get_auth_db),
 ):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -81,9 +84,12 @@ async def get_current_user(
         token_data = TokenData(username=username)
     except InvalidTokenError:
         raise credentials_exception
-    user = get_user(username=token_data.username, db=db)
+    user = users.get(token_data.username)
     if user is None:
-        raise credentials_exception
+        user = await get_user(username=token_data.username, db=db)
+        if user is None:
+            raise credentials_exception
+        users.put(user)
     return user
 
 
@@ -97,16 +103,45 @@ async def get_current_active_user(
 
 @router.post("/token")
 async def login_for_access_token(
+    request: Request,
     form_data: Annotated[OAuth2PasswordRequestForm, Depends()],
-    db: Session = Depends(get_auth_db),
+    db: AsyncSession = Depends(get_auth_db),
 ) -> Token:
-    user = authenticate_user(form_data.username, form_data.password, db)
+    # Repeated failures are refused before the password is checked
+    address = request.client.host if request.client else ""
+    retry_after = max(
+        usernames.retry_after(form_data.username), addresses.retry_after(address)
+    )
+    if retry_after:
+        LOGIN_REJECTIONS.labels("throttled").inc()
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed logins, try again later",
+            headers={"Retry-After": str(math.ceil(retry_after))},
+        )
+    try:
+        user = await authenticate_user(form_data.username, form_data.password, db)
+    except PasswordPoolFull:
+        LOGIN_REJECTIONS.labels("busy").inc()
+        logger.warning(
+            f"Password workers busy, refusing login for {form_data.username}"
+        )
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many logins in progress, try again later",
+            headers={"Retry-After": "1"},
+        )
     if not user:
+        usernames.failed(form_data.username)
+        addresses.failed(address)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    usernames.reset(form_data.username)
+    # The user was just read from the database, requests with the new token use it
+    users.put(user)
     access_token_expires = timedelta(minutes=JWT_ACCESS_TOKEN_EXPIRATION_MINUTES)
     access_token = create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
@@ -0,0 +1,134 @@
+import hashlib
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+
+from prometheus_client import Counter
+
+from src.weatherman.api import queries
+from src.weatherman.api.constants import (
+    RESPONSE_CACHE_REFRESH_SECONDS,
+    RESPONSE_CACHE_SIZE,
+    USER_CACHE_SIZE,
+    USER_CACHE_TTL_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+USER_CACHE_LOOKUPS = Counter(
+    "weatherman_api_user_cache_lookups",
+    "Authenticated users looked up in the API cache, by hit or miss",
+    ["result"],
+)
+RESPONSE_CACHE_LOOKUPS = Counter(
+    "weatherman_api_response_cache_lookups",
+    "Weather responses looked up in the API cache, by endpoint and hit or miss",
+    ["endpoint", "result"],
+)
+
+
+class UserCache:
+    # Users read from the auth database are kept for ttl_seconds, so a request with
+    # a valid token does not have to look its user up again. Once max_size users are
+    # cached the least recently used one is dropped. The API never changes users,
+    # changes made in the auth database, such as disabling a user, are picked up
+    # when the entry expires
+    def __init__(self, max_size, ttl_seconds):
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.users = OrderedDict()
+
+    def get(self, username):
+        entry = self.users.get(username)
+        if entry is None or entry[1] <= time.monotonic():
+            self.users.pop(username, None)
+            USER_CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        self.users.move_to_end(username)
+        USER_CACHE_LOOKUPS.labels("hit").inc()
+        return entry[0]
+
+    def put(self, user):
+        if self.ttl_seconds <= 0 or self.max_size <= 0:
+            return
+        self.users[user.username] = (user, time.monotonic() + self.ttl_seconds)
+        self.users.move_to_end(user.username)
+        while len(self.users) > self.max_size:
+            self.users.popitem(last=False)
+
+
+def etag(body):
+    return f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"'
+
+
+class ResponseCache:
+    # Response bodies of the per location endpoints, with their ETag. An entry is
+    # valid while the location's version is the one it was built with. The versions
+    # of all locations are read from the weather database at most every
+    # refresh_seconds, so a response is at most that much behind the latest ingest.
+    # Responses that change with the time of day, like today's forecast, are also
+    # given the seconds they stay valid for.
+    # Each API process keeps its own responses, the versions are shared through the
+    # database
+    def __init__(self, max_size, refresh_seconds):
+        self.max_size = max_size
+        self.refresh_seconds = refresh_seconds
+        self.versions = {}
+        self.refreshed = -math.inf
+        self.refreshing = False
+        self.responses = OrderedDict()
+
+    async def refresh(self, db):
+        # Requests arriving during a refresh go on with the versions read last time
+        if (
+            self.refresh_seconds <= 0
+            or self.refreshing
+            or time.monotonic() < self.refreshed + self.refresh_seconds
+        ):
+            return
+        self.refreshing = True
+        try:
+            rows = (await db.execute(queries.location_versions())).all()
+            self.versions = dict(rows)
+            self.refreshed = time.monotonic()
+        finally:
+            self.refreshing = False
+
+    def get(self, endpoint, location_id):
+        # Returns (etag, body), or None when the response has to be built
+        key = (endpoint, location_id)
+        entry = self.responses.get(key)
+        if (
+            entry is None
+            or entry[0] != self.versions.get(location_id)
+            or entry[1] <= time.monotonic()
+        ):
+            self.responses.pop(key, None)
+            RESPONSE_CACHE_LOOKUPS.labels(endpoint, "miss").inc()
+            return None
+        self.responses.move_to_end(key)
+        RESPONSE_CACHE_LOOKUPS.labels(endpoint, "hit").inc()
+        return entry[2:]
+
+    def put(self, endpoint, location_id, version, body, expires_in=math.inf):
+        # version is the one known before the body was read, a newer body is only
+        # rebuilt once more after the next refresh
+        entry = (version, time.monotonic() + expires_in, etag(body), body)
+        if version is not None and self.refresh_seconds > 0 and self.max_size > 0:
+            self.responses[(endpoint, location_id)] = entry
+            self.responses.move_to_end((endpoint, location_id))
+            while len(self.responses) > self.max_size:
+                self.responses.popitem(last=False)
+        return entry[2:]
+
+
+users = UserCache(
+    int(os.getenv("USER_CACHE_SIZE", USER_CACHE_SIZE)),
+    float(os.getenv("USER_CACHE_TTL_SECONDS", USER_CACHE_TTL_SECONDS)),
+)
+responses = ResponseCache(
+    int(os.getenv("RESPONSE_CACHE_SIZE", RESPONSE_CACHE_SIZE)),
+    float(os.getenv("RESPONSE_CACHE_REFRESH_SECONDS", RESPONSE_CACHE_REFRESH_SECONDS)),
+)
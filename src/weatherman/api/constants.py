@@ -1,2 +1,13 @@
 JWT_ALGORITHM = "HS256"
 JWT_ACCESS_TOKEN_EXPIRATION_MINUTES = 30
+USER_CACHE_SIZE = 1024
+USER_CACHE_TTL_SECONDS = 60
+PASSWORD_WORKERS = 2
+PASSWORD_QUEUE_SIZE = 16
+LOGIN_FAILURES_PER_USER = 5
+LOGIN_FAILURES_PER_IP = 20
+LOGIN_THROTTLE_SECONDS = 300
+LOGIN_THROTTLE_MAX_KEYS = 10000
+RESPONSE_CACHE_SIZE = 4096
+RESPONSE_CACHE_REFRESH_SECONDS = 5
+BATCH_MAX_LOCATIONS = 500
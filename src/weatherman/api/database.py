@@ -1,19 +1,23 @@
 from os import getenv, getcwd
-from sqlalchemy import create_engine
 import logging
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session
+
+from src.weatherman.storage import make_async_engine, make_engine
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 
-# Initialize authentication database connection
+# Initialize authentication database connection. Requests use the asyncio engines,
+# the synchronous ones are for startup checks, streaming exports and SQLite requests
 auth_db_url = getenv("AUTH_DATABASE_URL")
 if auth_db_url is None:
     logger.error("AUTH_DATABASE_URL environment variable not set")
     exit(1)
-engine = create_engine(auth_db_url)
+engine = make_engine(auth_db_url)
+async_engine = make_async_engine(auth_db_url)
 logger.info(f"Connected to authentication DB: {auth_db_url}")
 Base = declarative_base()
 
@@ -22,22 +26,41 @@ weather_db_url = getenv("DATABASE_URL")
 if weather_db_url is None:
     logger.error("DATABASE_URL environment variable not set")
     exit(1)
-weather_engine = create_engine(weather_db_url)
+weather_engine = make_engine(weather_db_url)
+async_weather_engine = make_async_engine(weather_db_url)
 logger.info(f"Connected to weather DB: {weather_db_url}")
 weather_base = declarative_base()
 
 
-def get_auth_db():
-    db = Session(engine)
-    try:
+class SQLiteSession:
+    # Stands in for AsyncSession on SQLite. A lookup takes microseconds there, less
+    # than handing it to a driver thread and back, so statements run right on the
+    # event loop. Each one holds a connection only while it executes, never across
+    # an await, so requests never wait for each other's connections
+    def __init__(self, engine):
+        self.engine = engine
+
+    async def execute(self, statement, parameters=None):
+        with Session(self.engine) as session:
+            return session.execute(statement, parameters).freeze()()
+
+    async def close(self):
+        pass
+
+
+async def session(engine, async_engine):
+    if async_engine is None:
+        yield SQLiteSession(engine)
+        return
+    async with AsyncSession(async_engine) as db:
+        yield db
+
+
+async def get_auth_db():
+    async for db in session(engine, async_engine):
         yield db
-    finally:
-        db.close()
 
 
-def get_weather_db():
-    db = Session(weather_engine)
-    try:
+async def get_weather_db():
+    async for db in session(weather_engine, async_weather_engine):
         yield db
-    finally:
-        db.close()
@@ -0,0 +1,60 @@
+import logging
+import sys
+from os import getenv
+
+from src.weatherman.api.queries import PLANS
+from src.weatherman.storage import make_engine
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+# Runs EXPLAIN for every API query against the database in DATABASE_URL and fails
+# when one of them reads a whole table or sorts rows instead of using an index:
+#   DATABASE_URL=sqlite:///data.db python -m src.weatherman.api.explain
+
+# Plan lines that mean a table is read in full, or rows are sorted after reading
+SLOW_PLAN_STEPS = {
+    "sqlite": ("SCAN ", "USE TEMP B-TREE"),
+    "postgresql": ("Seq Scan", "Sort  ("),
+}
+
+
+def explain(connection, statement):
+    compiled = statement.compile(connection, compile_kwargs={"literal_binds": True})
+    if connection.dialect.name == "sqlite":
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}")
+        return [row[-1] for row in rows]
+    rows = connection.exec_driver_sql(f"EXPLAIN {compiled}")
+    return [row[0] for row in rows]
+
+
+def slow_steps(dialect, plan):
+    return [
+        step
+        for step in plan
+        if any(marker in step for marker in SLOW_PLAN_STEPS.get(dialect, ()))
+    ]
+
+
+def check(engine):
+    failed = []
+    with engine.connect() as connection:
+        for name, (query, arguments, full_scan) in PLANS.items():
+            plan = explain(connection, query(*arguments))
+            slow = slow_steps(connection.dialect.name, plan)
+            logger.info(f"{name}: {' / '.join(step.strip() for step in plan)}")
+            if slow and not full_scan:
+                logger.error(
+                    f"{name} reads a whole table or sorts its rows: {', '.join(slow)}"
+                )
+                failed.append(name)
+    return failed
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[])
+    db_url = getenv("DATABASE_URL")
+    if db_url is None:
+        logger.error("DATABASE_URL environment variable not set")
+        exit(1)
+    sys.exit(1 if check(make_engine(db_url)) else 0)
@@ -0,0 +1,55 @@
+import asyncio
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+from prometheus_client import Gauge
+
+from src.weatherman.api.constants import PASSWORD_QUEUE_SIZE, PASSWORD_WORKERS
+
+logger = logging.getLogger(__name__)
+
+PASSWORD_JOBS = Gauge(
+    "weatherman_api_password_jobs",
+    "Password verifications running or waiting for a worker",
+)
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+
+class PasswordPoolFull(Exception):
+    pass
+
+
+class PasswordPool:
+    # bcrypt takes a few hundred milliseconds and releases the GIL, so it runs on a
+    # few worker threads instead of the event loop. At most queue_size jobs wait for
+    # a worker, further ones are refused rather than queued behind a login burst
+    def __init__(self, workers, queue_size):
+        self.limit = workers + queue_size
+        self.jobs = 0
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="password"
+        )
+
+    async def run(self, function, *args):
+        if self.jobs >= self.limit:
+            raise PasswordPoolFull()
+        self.jobs += 1
+        PASSWORD_JOBS.inc()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self.executor, function, *args)
+        finally:
+            self.jobs -= 1
+            PASSWORD_JOBS.dec()
+
+    async def verify(self, plain_password, hashed_password):
+        return await self.run(pwd_context.verify, plain_password, hashed_password)
+
+
+pool = PasswordPool(
+    max(int(os.getenv("PASSWORD_WORKERS", PASSWORD_WORKERS)), 1),
+    max(int(os.getenv("PASSWORD_QUEUE_SIZE", PASSWORD_QUEUE_SIZE)), 0),
+)
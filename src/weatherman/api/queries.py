@@ -0,0 +1,72 @@
+from sqlalchemy import Select
+
+from src.weatherman.ormodels import (
+    LatestCurrent,
+    LatestForecast,
+    Location,
+    LocationVersion,
+)
+from src.weatherman import export
+
+# Every query the API sends to the weather database. They live here so that
+# explain.py can check their query plans against a real database
+
+
+def latest_current(location_ids):
+    return Select(LatestCurrent).where(LatestCurrent.location_id.in_(location_ids))
+
+
+def latest_forecast(location_ids):
+    # Every forecast date kept for the locations
+    return Select(LatestForecast).where(LatestForecast.location_id.in_(location_ids))
+
+
+def latest_current_ids(after, limit):
+    return (
+        Select(LatestCurrent.location_id)
+        .where(LatestCurrent.location_id > after)
+        .order_by(LatestCurrent.location_id)
+        .limit(limit)
+    )
+
+
+def latest_forecast_ids(after, limit):
+    return (
+        Select(LatestForecast.location_id)
+        .distinct()
+        .where(LatestForecast.location_id > after)
+        .order_by(LatestForecast.location_id)
+        .limit(limit)
+    )
+
+
+def all_locations():
+    return Select(Location)
+
+
+def location_versions():
+    return Select(LocationVersion.location_id, LocationVersion.version)
+
+
+def export_history(table, location_ids):
+    # The export endpoint streams these, see export.py
+    return export.export_query(table, location_ids)
+
+
+# Query, sample arguments and whether reading the whole table is expected
+PLANS = {
+    "latest_current": (latest_current, [[1, 2, 3]], False),
+    "latest_forecast": (latest_forecast, [[1, 2, 3]], False),
+    "latest_current_ids": (latest_current_ids, [0, 500], False),
+    "latest_forecast_ids": (latest_forecast_ids, [0, 500], False),
+    "all_locations": (all_locations, [], True),
+    "location_versions": (location_versions, [], True),
+    **{
+        f"export_{table}": (export_history, [table, None], True)
+        for table in export.TABLES
+    },
+    **{
+        f"export_{table}_by_location": (export_history, [table, [1]], False)
+        for table in export.TABLES
+    },
+}
@@ -0,0 +1,73 @@
+import logging
+import os
+import time
+
+from prometheus_client import Counter
+
+from src.weatherman.api.constants import (
+    LOGIN_FAILURES_PER_IP,
+    LOGIN_FAILURES_PER_USER,
+    LOGIN_THROTTLE_MAX_KEYS,
+    LOGIN_THROTTLE_SECONDS,
+)
+
+logger = logging.getLogger(__name__)
+
+LOGIN_REJECTIONS = Counter(
+    "weatherman_api_login_rejections",
+    "Logins refused before the password was checked, by reason",
+    ["reason"],
+)
+
+
+class LoginThrottle:
+    # Counts failed logins per key (a username or a client address). After limit
+    # failures the key is refused until window_seconds have passed since its first
+    # failure. At most max_keys are tracked, the oldest are dropped first
+    def __init__(self, limit, window_seconds, max_keys=LOGIN_THROTTLE_MAX_KEYS):
+        self.limit = limit
+        self.window_seconds = window_seconds
+        self.max_keys = max_keys
+        self.failures = {}
+
+    def retry_after(self, key):
+        # Seconds until key may try again, 0 if it may now
+        entry = self.failures.get(key)
+        if entry is None:
+            return 0
+        expires, count = entry
+        remaining = expires - time.monotonic()
+        if remaining <= 0:
+            del self.failures[key]
+            return 0
+        return remaining if count >= self.limit else 0
+
+    def failed(self, key):
+        if self.limit <= 0:
+            return
+        now = time.monotonic()
+        expires, count = self.failures.pop(key, (0, 0))
+        if expires <= now:
+            expires, count = now + self.window_seconds, 0
+        self.failures[key] = (expires, count + 1)
+        if len(self.failures) > self.max_keys:
+            self.prune(now)
+
+    def reset(self, key):
+        self.failures.pop(key, None)
+
+    def prune(self, now):
+        self.failures = {
+            key: entry for key, entry in self.failures.items() if entry[0] > now
+        }
+        while len(self.failures) > self.max_keys:
+            del self.failures[next(iter(self.failures))]
+
+
+window = float(os.getenv("LOGIN_THROTTLE_SECONDS", LOGIN_THROTTLE_SECONDS))
+usernames = LoginThrottle(
+    int(os.getenv("LOGIN_FAILURES_PER_USER", LOGIN_FAILURES_PER_USER)), window
+)
+addresses = LoginThrottle(
+    int(os.getenv("LOGIN_FAILURES_PER_IP", LOGIN_FAILURES_PER_IP)), window
+)
@@ -1,75 +1,271 @@
 import logging
-from fastapi import APIRouter, Depends, Security, HTTPException
-from sqlalchemy import Select
-from sqlalchemy.orm import Session
+import math
+from datetime import datetime, timedelta, timezone
+from os import getenv
+from typing import Dict, List, Optional
+from zoneinfo import ZoneInfo
+from fastapi import APIRouter, Depends, Query, Request, Security, HTTPException
+from fastapi.responses import Response, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.weatherman.api import auth
-from src.weatherman.api.database import get_weather_db
-from src.weatherman.ormodels import Location, Daily, Condition
-from src.weatherman.ormodels import CurrentWeather as ORCurrentWeather
-from src.weatherman.ormodels import Forecast as ORForecast
-from src.weatherman.api.models import CurrentWeather, DailyForecast, ForecastMetadata
+from src.weatherman.api.database import get_weather_db, weather_engine
+from src.weatherman.api import queries
+from src.weatherman.api.cache import etag, responses
+from src.weatherman.api.constants import BATCH_MAX_LOCATIONS
+from src.weatherman import export
+from src.weatherman.api.models import CurrentWeather, DailyForecast
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix="/api/v1/weather")
 
+BATCH_MAX_LOCATIONS = int(getenv("BATCH_MAX_LOCATIONS", BATCH_MAX_LOCATIONS))
+EXPORT_BATCH_SIZE = max(int(getenv("EXPORT_BATCH_SIZE", export.EXPORT_BATCH_SIZE)), 1)
+NOT_FOUND = {
+    "latest_current": "Weather data not found for location",
+    "forecast_daily": "Forecast data not found for location",
+}
+
+
+def copied(row, prefix):
+    # Location or condition copied into a latest state row, e.g. location_name
+    return {
+        name[len(prefix) :]: value
+        for name, value in row.items()
+        if name.startswith(prefix)
+    }
+
+
+def etag_matches(if_none_match, etag):
+    if if_none_match is None:
+        return False
+    return any(
+        tag.strip().removeprefix("W/") in (etag, "*")
+        for tag in if_none_match.split(",")
+    )
+
+
+def etagged(request, etag, body):
+    # 304 when the client already has this version
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+
+async def cached_response(request, db, endpoint, location_id, read):
+    # Answers from the response cache while the location's data is unchanged. read
+    # returns the model of every location found and the seconds it stays valid for
+    await responses.refresh(db)
+    entry = responses.get(endpoint, location_id)
+    if entry is None:
+        version = responses.versions.get(location_id)
+        found = (await read(db, [location_id])).get(location_id)
+        if found is None:
+            raise HTTPException(status_code=404, detail=NOT_FOUND[endpoint])
+        model, expires_in = found
+        entry = responses.put(
+            endpoint, location_id, version, model.model_dump_json().encode(), expires_in
+        )
+    return etagged(request, *entry)
+
+
+async def cached_batch_response(request, db, endpoint, location_ids, read):
+    # Same as cached_response for many locations, the ones missing from the cache
+    # are read with a single query. Locations without data are left out of the map
+    await responses.refresh(db)
+    bodies = {}
+    for location_id in location_ids:
+        entry = responses.get(endpoint, location_id)
+        if entry is not None:
+            bodies[location_id] = entry[1]
+    missing = [location_id for location_id in location_ids if location_id not in bodies]
+    if missing:
+        versions = {
+            location_id: responses.versions.get(location_id) for location_id in missing
+        }
+        for location_id, (model, expires_in) in (await read(db, missing)).items():
+            _, bodies[location_id] = responses.put(
+                endpoint,
+                location_id,
+                versions[location_id],
+                model.model_dump_json().encode(),
+                expires_in,
+            )
+    body = b"{%b}" % b",".join(
+        b'"%d":%b' % (location_id, bodies[location_id])
+        for location_id in location_ids
+        if location_id in bodies
+    )
+    return etagged(request, etag(body), body)
+
+
+async def batch_location_ids(db, location_ids, after, ids_query):
+    # The requested locations, or a page of all locations after the given id
+    if len(location_ids) > BATCH_MAX_LOCATIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"At most {BATCH_MAX_LOCATIONS} locations per request",
+        )
+    if location_ids:
+        return list(dict.fromkeys(location_ids))
+    return list(
+        (await db.execute(ids_query(after, BATCH_MAX_LOCATIONS))).scalars().all()
+    )
+
+
+def current_weather(latest):
+    row = latest.model_dump()
+    return CurrentWeather.model_validate(
+        row
+        | {
+            "id": latest.currentweather_id,
+            "location": copied(row, "location_"),
+            "condition": copied(row, "condition_"),
+        }
+    )
+
+
+def forecast(latest):
+    row = latest.model_dump()
+    return DailyForecast.model_validate(
+        row
+        | {
+            "id": latest.daily_id,
+            "condition": copied(row, "condition_"),
+            "forecast_metadata": {
+                "id": latest.forecast_id,
+                "location_id": latest.location_id,
+                "date": latest.date,
+                "location": copied(row, "location_"),
+            },
+        }
+    )
+
+
+def local_now(tz_id):
+    try:
+        return datetime.now(ZoneInfo(tz_id))
+    except (KeyError, ValueError):
+        logger.warning(f"Unknown time zone {tz_id}, using UTC")
+        return datetime.now(timezone.utc)
+
+
+async def read_current_weather(db, location_ids):
+    rows = (await db.execute(queries.latest_current(location_ids))).scalars()
+    return {latest.location_id: (current_weather(latest), math.inf) for latest in rows}
+
+
+async def read_forecast(db, location_ids):
+    # Today's forecast in the location's time zone, valid until its midnight. When
+    # today is missing, the forecast for the closest date is used
+    rows = {}
+    for row in (await db.execute(queries.latest_forecast(location_ids))).scalars():
+        rows.setdefault(row.location_id, []).append(row)
+    found = {}
+    for location_id, days in rows.items():
+        now = local_now(days[0].location_tz_id)
+        today = now.date()
+        latest = min(
+            days,
+            key=lambda row: (abs(row.date.date() - today), row.date.date() < today),
+        )
+        midnight = datetime.combine(today + timedelta(days=1), datetime.min.time())
+        expires_in = midnight.replace(tzinfo=now.tzinfo).timestamp() - now.timestamp()
+        found[location_id] = (forecast(latest), expires_in)
+    return found
+
 
 @router.get("/latest_current/{location_id}", response_model=CurrentWeather)
 async def get_current_weather(
     location_id: int,
-    db: Session = Depends(get_weather_db),
+    request: Request,
+    db: AsyncSession = Depends(get_weather_db),
     current_user=Security(auth.get_current_user),
 ):
-    select_weather = (
-        Select(ORCurrentWeather)
-        .where(ORCurrentWeather.location_id == location_id)
-        .order_by(ORCurrentWeather.last_updated.desc())
+    return await cached_response(
+        request, db, "latest_current", location_id, read_current_weather
     )
-    latest_weather = db.execute(select_weather).first()
-    location = db.get(Location, location_id)
-    if latest_weather and location:
-        weather = CurrentWeather.model_validate(latest_weather[0])
-        weather.location = location
-        return weather
-    else:
-        raise HTTPException(
-            status_code=404, detail="Weather data not found for location"
-        )
 
 
 @router.get("/forecast_daily/{location_id}", response_model=DailyForecast)
 async def get_forecast(
     location_id: int,
-    db: Session = Depends(get_weather_db),
+    request: Request,
+    db: AsyncSession = Depends(get_weather_db),
     current_user=Security(auth.get_current_user),
 ):
-    select_forecast = (
-        Select(ORForecast)
-        .where(ORForecast.location_id == location_id)
-        .order_by(ORForecast.date.desc())
+    return await cached_response(
+        request, db, "forecast_daily", location_id, read_forecast
+    )
+
+
+@router.get("/latest_current", response_model=Dict[int, CurrentWeather])
+async def get_current_weather_batch(
+    request: Request,
+    location_id: List[int] = Query(default=[]),
+    after: int = 0,
+    db: AsyncSession = Depends(get_weather_db),
+    current_user=Security(auth.get_current_user),
+):
+    location_ids = await batch_location_ids(
+        db, location_id, after, queries.latest_current_ids
+    )
+    return await cached_batch_response(
+        request, db, "latest_current", location_ids, read_current_weather
+    )
+
+
+@router.get("/forecast_daily", response_model=Dict[int, DailyForecast])
+async def get_forecast_batch(
+    request: Request,
+    location_id: List[int] = Query(default=[]),
+    after: int = 0,
+    db: AsyncSession = Depends(get_weather_db),
+    current_user=Security(auth.get_current_user),
+):
+    location_ids = await batch_location_ids(
+        db, location_id, after, queries.latest_forecast_ids
+    )
+    return await cached_batch_response(
+        request, db, "forecast_daily", location_ids, read_forecast
     )
-    latest_forecast = db.execute(select_forecast).first()[0]
-    logger.debug(f"Latest forecast: {latest_forecast}")
-    if latest_forecast:
-        data_stmt = Select(Daily).where(Daily.forecast_id == latest_forecast.id)
-        forecast_data = db.execute(data_stmt).one()[0]
-        logger.debug(f"Forecast data: {forecast_data}")
-        cond_stmt = Select(Condition).where(Condition.daily_id == forecast_data.id)
-        condition = db.execute(cond_stmt).one()[0]
-        forecast = DailyForecast.model_validate(forecast_data)
-        forecast.condition = Condition.model_validate(condition)
-        forecast.forecast_metadata = ForecastMetadata.model_validate(latest_forecast)
-        return forecast
-    else:
-        raise HTTPException(
-            status_code=404, detail="Forecast data not found for location"
-        )
 
 
 @router.get("/locations")
 async def get_locations(
-    db: Session = Depends(get_weather_db),
+    db: AsyncSession = Depends(get_weather_db),
     current_user=Security(auth.get_current_user),
 ):
-    locations = db.query(Location).all()
+    locations = (await db.execute(queries.all_locations())).scalars().all()
     return locations
+
+
+@router.get("/export/{table}")
+async def export_history(
+    table: str,
+    format: str = "parquet",
+    location_id: List[int] = Query(default=[]),
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    current_user=Security(auth.get_current_user),
+):
+    if table not in export.TABLES:
+        raise HTTPException(status_code=404, detail=f"Unknown table {table}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format {format}")
+    # Record batches are sent as they are written, the export is never held in
+    # memory as a whole
+    return StreamingResponse(
+        export.stream(
+            weather_engine,
+            table,
+            format,
+            location_id,
+            start,
+            end,
+            EXPORT_BATCH_SIZE,
+        ),
+        media_type=export.FORMATS[format],
+        headers={"Content-Disposition": f'attachment; filename="{table}.{format}"'},
+    )
@@ -0,0 +1,91 @@
+import gzip
+import logging
+import os
+import threading
+import zlib
+from datetime import datetime, timezone
+
+import msgspec
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+
+class ResponseArchive:
+    # Appends every raw API response to gzip compressed JSONL segments, one folder
+    # per UTC day and a fixed number of shards per day, picked by location:
+    #   <directory>/<YYYY-MM-DD>/shard-<NN>.jsonl.gz
+    # Each line is {"fetched_at": ..., "location": ..., "response": <raw response>}
+    def __init__(self, directory, shards):
+        self.directory = directory
+        self.shards = shards
+        self.day = None
+        self.files = {}
+        self.lock = threading.Lock()
+
+    def path(self, day, shard):
+        return os.path.join(self.directory, day, f"shard-{shard:02d}.jsonl.gz")
+
+    def append(self, location, raw):
+        fetched_at = datetime.now(timezone.utc)
+        if b"\n" in raw:
+            # Keep one response per line
+            raw = msgspec.json.encode(msgspec.json.decode(raw))
+        line = b"".join(
+            [
+                b'{"fetched_at":',
+                msgspec.json.encode(fetched_at.isoformat()),
+                b',"location":',
+                msgspec.json.encode(location),
+                b',"response":',
+                raw,
+                b"}\n",
+            ]
+        )
+        shard = zlib.crc32(location.encode()) % self.shards
+        with self.lock:
+            day = fetched_at.strftime("%Y-%m-%d")
+            if day != self.day:
+                self.close_files()
+                self.day = day
+            segment = self.files.get(shard)
+            if segment is None:
+                path = self.path(day, shard)
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                segment = self.files[shard] = gzip.open(path, "ab")
+            segment.write(line)
+            # A sync flush keeps everything written so far readable after a crash
+            segment.flush()
+
+    def close_files(self):
+        for segment in self.files.values():
+            segment.close()
+        self.files = {}
+
+    def close(self):
+        with self.lock:
+            self.close_files()
+
+
+def segment_paths(paths):
+    # Expands directories into the segments below them, oldest day first
+    for path in paths:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.endswith(".jsonl.gz"):
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+
+def read_segment(path):
+    # Yields raw lines. A segment cut short by a crash ends at its last full line
+    with gzip.open(path, "rb") as segment:
+        try:
+            for line in segment:
+                if line.endswith(b"\n"):
+                    yield line
+        except (EOFError, zlib.error) as e:
+            logger.warning(f"Segment {path} is truncated, stopping there: {e}")
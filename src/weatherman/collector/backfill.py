@@ -0,0 +1,81 @@
+import argparse
+import logging
+import os
+import time
+
+from src.weatherman.db import engine
+from src.weatherman.migrations import migrate
+from src.weatherman.collector.archive import read_segment, segment_paths
+from src.weatherman.collector.weatherapi import save_many_from_json
+from src.weatherman.collector import schema
+import src.weatherman.collector.cache as cache
+
+import constants
+import msgspec
+
+loglevel = os.getenv("LOG_LEVEL", "INFO")
+logging.basicConfig(
+    level=logging.getLevelName(loglevel),
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+    datefmt="%d-%b-%y %H:%M:%S",
+    handlers=[logging.StreamHandler()],
+)
+logger = logging.getLogger(__name__)
+
+
+def read_archive(paths):
+    for path in segment_paths(paths):
+        logger.info(f"Replaying {path}")
+        for line in read_segment(path):
+            try:
+                yield schema.archive_decoder.decode(line).response
+            except msgspec.MsgspecError as e:
+                logger.warning(f"Skipping unreadable record in {path}: {e}")
+
+
+def backfill(paths, batch_size, language):
+    # Replays archived responses through the normal ingest path. Writes are upserts,
+    # so replaying the same segments twice leaves the database unchanged
+    migrate(engine)
+    cache.conditions.load()
+    cache.locations.load()
+    started = time.perf_counter()
+    responses = 0
+    batch = []
+    for response in read_archive(paths):
+        batch.append(response)
+        if len(batch) >= batch_size:
+            save_many_from_json(batch, language=language)
+            responses += len(batch)
+            batch = []
+    if batch:
+        save_many_from_json(batch, language=language)
+        responses += len(batch)
+    elapsed = time.perf_counter() - started
+    logger.info(f"Replayed {responses} responses in {elapsed:.1f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load archived weather API responses into the database"
+    )
+    parser.add_argument(
+        "paths", nargs="+", help="Archive directories or .jsonl.gz segments"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(os.getenv("BACKFILL_BATCH_SIZE", constants.BACKFILL_BATCH_SIZE)),
+        help="Responses written per transaction",
+    )
+    parser.add_argument(
+        "--language",
+        default=os.getenv("WEATHER_API_LANGUAGE", constants.DEFAULT_LANGUAGE),
+        help="Language the archived responses were fetched in",
+    )
+    args = parser.parse_args()
+    backfill(args.paths, max(args.batch_size, 1), args.language)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+from sqlalchemy import Select
+from sqlmodel import Session
+
+from src.weatherman.db import engine, upsert
+from src.weatherman.ormodels import Condition, Location
+import logging
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+
+class ConditionCache:
+    # weatherapi.com only has a few dozen condition codes, so every condition the
+    # collector has seen is kept in memory, keyed by (code, is_day, language)
+    def __init__(self):
+        self.ids = {}
+
+    def load(self):
+        with Session(engine) as db:
+            rows = db.execute(
+                Select(
+                    Condition.id, Condition.code, Condition.is_day, Condition.language
+                )
+            ).all()
+        self.ids = {(row.code, row.is_day, row.language): row.id for row in rows}
+        logger.debug(f"Loaded {len(self.ids)} conditions into cache")
+
+    def resolve(self, conditions):
+        # conditions maps (code, is_day, language) keys to condition rows. Unknown
+        # conditions are saved in their own short transaction, so they are never
+        # cached from an ingest transaction that gets rolled back
+        missing = [row for key, row in conditions.items() if key not in self.ids]
+        if missing:
+            logger.debug(f"Saving {len(missing)} new conditions")
+            with Session(engine) as db, db.begin():
+                rows = upsert(
+                    db,
+                    Condition,
+                    missing,
+                    ["code", "is_day", "language"],
+                    update_columns=["text", "icon"],
+                    returning=["id", "code", "is_day", "language"],
+                )
+            for row in rows:
+                self.ids[(row.code, row.is_day, row.language)] = row.id
+        return {key: self.ids[key] for key in conditions}
+
+
+class LocationCache:
+    # Maps (name, region, country) to location ids, so steady state ingest never
+    # has to touch the location table
+    def __init__(self):
+        self.ids = {}
+
+    def load(self):
+        with Session(engine) as db:
+            rows = db.execute(
+                Select(Location.id, Location.name, Location.region, Location.country)
+            ).all()
+        self.ids = {(row.name, row.region, row.country): row.id for row in rows}
+        logger.debug(f"Loaded {len(self.ids)} locations into cache")
+
+    def resolve_many(self, locations):
+        keys = [
+            (location["name"], location["region"], location["country"])
+            for location in locations
+        ]
+        missing = {
+            key: location
+            for key, location in zip(keys, locations)
+            if key not in self.ids
+        }
+        if missing:
+            # A no-op update returns the id of an existing row as well as a new one
+            with Session(engine) as db, db.begin():
+                rows = upsert(
+                    db,
+                    Location,
+                    list(missing.values()),
+                    ["name", "region", "country"],
+                    update_columns=["name"],
+                    returning=["id", "name", "region", "country"],
+                )
+            for row in rows:
+                self.ids[(row.name, row.region, row.country)] = row.id
+            logger.debug(f"Resolved {len(rows)} locations missing from cache")
+        return [self.ids[key] for key in keys]
+
+
+conditions = ConditionCache()
+locations = LocationCache()
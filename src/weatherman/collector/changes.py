@@ -0,0 +1,71 @@
+import hashlib
+import logging
+
+import msgspec
+
+from src.weatherman.collector.schema import ForecastData
+from src.weatherman.collector import metrics
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+
+def section_digest(section):
+    return hashlib.blake2b(msgspec.json.encode(section), digest_size=16).digest()
+
+
+class Changes:
+    def __init__(self, location, data, last_updated, forecast_digests):
+        self.location = location
+        self.data = data
+        self.last_updated = last_updated
+        self.forecast_digests = forecast_digests
+
+
+class ChangeDetector:
+    # weatherapi.com refreshes current weather about every 15 minutes, and forecasts
+    # less often than that. Remembering what was last saved per location lets the
+    # collector drop unchanged parts of a response before any parsing or DB work
+    def __init__(self):
+        self.last_updated = {}
+        self.forecast_digests = {}
+        self.skipped = {"responses": 0, "current": 0, "forecast_days": 0}
+
+    def detect(self, data):
+        # Returns the changed parts of a response, or None if nothing changed. Call
+        # remember() with the result once it has been saved
+        location = (data.location.name, data.location.region, data.location.country)
+        current = None
+        last_updated = data.current.last_updated if data.current else None
+        if self.last_updated.get(location) != last_updated:
+            current = data.current
+        else:
+            self.skip("current")
+
+        previous_digests = self.forecast_digests.get(location, {})
+        forecast_digests = {}
+        forecast_days = []
+        for forecast_data in data.forecast.forecastday:
+            digest = section_digest(forecast_data)
+            forecast_digests[forecast_data.date] = digest
+            if previous_digests.get(forecast_data.date) != digest:
+                forecast_days.append(forecast_data)
+            else:
+                self.skip("forecast_days")
+
+        if current is None and not forecast_days:
+            self.skip("responses")
+            logger.debug(f"Weather for {data.location.name} has not changed")
+            return None
+        changed = msgspec.structs.replace(
+            data, current=current, forecast=ForecastData(forecastday=forecast_days)
+        )
+        return Changes(location, changed, last_updated, forecast_digests)
+
+    def skip(self, part):
+        self.skipped[part] += 1
+        metrics.UNCHANGED.labels(part).inc()
+
+    def remember(self, changes):
+        self.last_updated[changes.location] = changes.last_updated
+        self.forecast_digests[changes.location] = changes.forecast_digests
@@ -1,17 +1,32 @@
 import os
+import signal
+import socket
+from datetime import timedelta
 
 from apscheduler import AsyncScheduler
 from apscheduler.triggers.interval import IntervalTrigger
-from asyncio import run
+from apscheduler import ConflictPolicy
+import asyncio
 
-from sqlalchemy import inspect
-from sqlmodel import SQLModel
 from src.weatherman.db import engine
+from src.weatherman.migrations import ensure_partitions, migrate
 from src.weatherman.ormodels import Location, CurrentWeather, Condition, Forecast
 from src.weatherman.collector.weatherapi import WeatherApi
+from src.weatherman.collector.ratelimit import TokenBucket
+from src.weatherman.collector.archive import ResponseArchive
+from src.weatherman.collector.leases import LeaseManager
+from src.weatherman.collector import metrics
+from src.weatherman.collector.retention import apply_retention
+from src.weatherman.collector.schedules import (
+    LocationFile,
+    LocationSchedules,
+    parse_locations,
+)
+import src.weatherman.collector.cache as cache
 
 
 # TODO: remove imports and pick location from config file
+import constants
 from constants import LOCATIONS
 import logging
 
@@ -24,14 +39,6 @@ logging.basicConfig(
 )
 
 
-async def validate_configuration_line(location, interval):
-    if not isinstance(location, str):
-        return False
-    if not interval.isdigit():
-        return False
-    return True
-
-
 async def main():
     logger = logging.getLogger(__name__)
     logger.addHandler(logging.StreamHandler())
@@ -41,36 +48,170 @@ async def main():
     if not key:
         logger.error("No API key found. Exiting.")
         exit(1)
-    weather = WeatherApi(key)
+    max_concurrent_fetches = int(
+        os.getenv("MAX_CONCURRENT_FETCHES", constants.MAX_CONCURRENT_FETCHES)
+    )
+    # Raw responses are only archived when a directory is configured
+    archive_dir = os.getenv("ARCHIVE_DIR", None)
+    archive = None
+    if archive_dir:
+        archive = ResponseArchive(
+            archive_dir, int(os.getenv("ARCHIVE_SHARDS", constants.ARCHIVE_SHARDS))
+        )
+    weather = WeatherApi(
+        key,
+        max_concurrent_fetches=max_concurrent_fetches,
+        timeout=float(
+            os.getenv("HTTP_TIMEOUT_SECONDS", constants.HTTP_TIMEOUT_SECONDS)
+        ),
+        max_connections=int(
+            os.getenv("HTTP_MAX_CONNECTIONS", constants.HTTP_MAX_CONNECTIONS)
+        ),
+        max_keepalive_connections=int(
+            os.getenv(
+                "HTTP_MAX_KEEPALIVE_CONNECTIONS",
+                constants.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            )
+        ),
+        language=os.getenv("WEATHER_API_LANGUAGE", constants.DEFAULT_LANGUAGE),
+        forecast_days=int(os.getenv("FORECAST_DAYS", constants.FORECAST_DAYS)),
+        rate_limit=TokenBucket(
+            # Plans are sold per month, spread that budget evenly over time
+            int(os.getenv("API_CALLS_PER_MONTH", constants.API_CALLS_PER_MONTH))
+            / timedelta(days=30).total_seconds(),
+            int(os.getenv("API_BURST_CALLS", constants.API_BURST_CALLS)),
+        ),
+        retries=int(os.getenv("FETCH_RETRIES", constants.FETCH_RETRIES)),
+        retry_base=float(os.getenv("RETRY_BASE_SECONDS", constants.RETRY_BASE_SECONDS)),
+        retry_max=float(os.getenv("RETRY_MAX_SECONDS", constants.RETRY_MAX_SECONDS)),
+        write_queue_size=int(os.getenv("WRITE_QUEUE_SIZE", constants.WRITE_QUEUE_SIZE)),
+        write_batch_size=int(os.getenv("WRITE_BATCH_SIZE", constants.WRITE_BATCH_SIZE)),
+        write_flush_seconds=float(
+            os.getenv("WRITE_FLUSH_SECONDS", constants.WRITE_FLUSH_SECONDS)
+        ),
+        archive=archive,
+    )
 
-    # Check if tables are present and create them if not
-    logging.debug("Checking if tables are present and creating tables")
-    if not inspect(engine).has_table(engine, "location"):
-        SQLModel.metadata.create_all(engine)
+    # Prometheus metrics are only served when a port is configured
+    metrics_port = int(os.getenv("METRICS_PORT", constants.METRICS_PORT))
+    if metrics_port:
+        metrics.serve(metrics_port)
+
+    # Create the tables, or bring an existing database up to date
+    migrate(engine)
+    cache.conditions.load()
+    cache.locations.load()
 
     # Get list of locations to fetch weather for
     input_file = os.getenv("LOCATION_FILE", None)
     if input_file:
-        with open(input_file, "r") as f:
-            locations = f.readlines()
+        location_file = LocationFile(input_file)
+        location_file.changed()
+        locations = location_file.read()
     else:
-        locations = LOCATIONS
-
-    async with AsyncScheduler() as scheduler:
-        for item in locations:
-            location, interval_minutes = item.strip().split(",")
-            if not validate_configuration_line(location, interval_minutes):
-                logger.error(f"Invalid configuration line: {item}")
-                continue
-            logger.info(
-                f"Adding schedule for {location}, with interval {interval_minutes} minutes"
+        locations = parse_locations(LOCATIONS)
+
+    # Bulk requests are only available on paid weatherapi.com plans
+    batch_size = min(
+        max(int(os.getenv("BULK_BATCH_SIZE", constants.BULK_BATCH_SIZE)), 1),
+        constants.MAX_BULK_BATCH_SIZE,
+    )
+
+    # Several collectors can share the locations through leases in the database
+    lease_seconds = float(os.getenv("LEASE_SECONDS", constants.LEASE_SECONDS))
+    leases = None
+    if lease_seconds > 0:
+        leases = LeaseManager(
+            os.getenv("COLLECTOR_ID", f"{socket.gethostname()}-{os.getpid()}"),
+            lease_seconds,
+        )
+        logger.info(f"Sharing locations with other collectors as {leases.member_id}")
+
+    # A fetch job holds the fetch semaphore only while it requests, and backs off
+    # outside it. Twice the fetch limit keeps every fetch slot busy while other jobs
+    # wait to retry, however many locations are added later, and leaves room for
+    # the housekeeping jobs below
+    async with weather, AsyncScheduler(
+        max_concurrent_jobs=2 * max_concurrent_fetches + 4
+    ) as scheduler:
+        schedules = LocationSchedules(
+            scheduler, weather.fetch_and_save_bulk_weather, batch_size, leases
+        )
+        await schedules.sync(locations)
+
+        # Renew leases well before they expire, picking up joining and leaving peers
+        if leases:
+            await scheduler.add_schedule(
+                schedules.rebalance,
+                id="rebalance-locations",
+                trigger=IntervalTrigger(seconds=lease_seconds / 3),
+                conflict_policy=ConflictPolicy.replace,
+            )
+
+        # Pick up edits to the location file without a restart. Only the changed
+        # locations are rescheduled, everything else keeps running as it was
+        if input_file:
+            await scheduler.add_schedule(
+                schedules.reload,
+                id="reload-locations",
+                args=[location_file],
+                trigger=IntervalTrigger(
+                    seconds=float(
+                        os.getenv(
+                            "LOCATION_RELOAD_SECONDS", constants.LOCATION_RELOAD_SECONDS
+                        )
+                    )
+                ),
+                conflict_policy=ConflictPolicy.replace,
+            )
+        # Roll up and delete old observations. The job is synchronous and can take
+        # seconds, so it runs on the scheduler's thread pool instead of the event loop
+        retention_days = int(os.getenv("RETENTION_DAYS", constants.RETENTION_DAYS))
+        if retention_days > 0:
+            await scheduler.add_schedule(
+                apply_retention,
+                id="retention",
+                args=[
+                    retention_days,
+                    int(
+                        os.getenv(
+                            "RETENTION_BATCH_SIZE", constants.RETENTION_BATCH_SIZE
+                        )
+                    ),
+                ],
+                trigger=IntervalTrigger(
+                    minutes=int(
+                        os.getenv(
+                            "RETENTION_INTERVAL_MINUTES",
+                            constants.RETENTION_INTERVAL_MINUTES,
+                        )
+                    )
+                ),
+                job_executor="threadpool",
+                conflict_policy=ConflictPolicy.replace,
             )
+        # Monthly partitions on PostgreSQL are created ahead of time, check daily. The
+        # DDL may move rows out of the default partition, off the event loop as well
+        if engine.dialect.name == "postgresql":
             await scheduler.add_schedule(
-                weather.fetch_and_save_weather,
-                args=[location, "forecast"],
-                trigger=IntervalTrigger(minutes=int(interval_minutes)),
+                ensure_partitions,
+                id="partitions",
+                args=[engine],
+                trigger=IntervalTrigger(days=1),
+                job_executor="threadpool",
+                conflict_policy=ConflictPolicy.replace,
+            )
+        # Stop cleanly on SIGTERM (e.g. docker stop), so queued writes are drained
+        try:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.ensure_future(scheduler.stop())
             )
+        except NotImplementedError:
+            pass
         await scheduler.run_until_stopped()
+    # Hand our locations to the other collectors right away instead of on expiry
+    if leases:
+        await asyncio.to_thread(leases.release)
 
 
-run(main())
+asyncio.run(main())
@@ -9,3 +9,27 @@ LOCATIONS = [
     "London,15",
     "Prague,5",
 ]
+MAX_CONCURRENT_FETCHES = 50
+HTTP_TIMEOUT_SECONDS = 10.0
+HTTP_MAX_CONNECTIONS = 50
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 20
+DEFAULT_LANGUAGE = "en"
+BULK_BATCH_SIZE = 1
+MAX_BULK_BATCH_SIZE = 50
+FORECAST_DAYS = 3
+API_CALLS_PER_MONTH = 0
+API_BURST_CALLS = 10
+FETCH_RETRIES = 3
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 60.0
+WRITE_QUEUE_SIZE = 1000
+WRITE_BATCH_SIZE = 50
+WRITE_FLUSH_SECONDS = 1.0
+ARCHIVE_SHARDS = 8
+BACKFILL_BATCH_SIZE = 500
+LOCATION_RELOAD_SECONDS = 30
+LEASE_SECONDS = 0
+METRICS_PORT = 0
+RETENTION_DAYS = 0
+RETENTION_BATCH_SIZE = 5000
+RETENTION_INTERVAL_MINUTES = 60
@@ -0,0 +1,106 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, select
+from sqlmodel import Session
+
+from src.weatherman.db import engine, upsert
+from src.weatherman.ormodels import CollectorMember, LocationLease
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+
+def rendezvous_owner(location, members):
+    # Highest random weight hashing: every instance computes the same owner from the
+    # same member list, and a member joining or leaving only moves its share
+    return max(
+        members,
+        key=lambda member: hashlib.blake2b(
+            f"{member}\0{location}".encode(), digest_size=8
+        ).digest(),
+    )
+
+
+def utcnow():
+    # Stored naive, like every other timestamp in the weather database
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class LeaseManager:
+    # Splits locations between collector instances sharing a database. Each
+    # renew() heartbeats this instance, works out its fair share of the locations
+    # from the live members, hands back leases that now belong to someone else and
+    # claims its share. A lease is only taken over once its holder released it or
+    # let it expire, so two instances never fetch the same location at once
+    def __init__(self, member_id, lease_seconds):
+        self.member_id = member_id
+        self.lease = timedelta(seconds=lease_seconds)
+
+    def renew(self, locations):
+        now = utcnow()
+        with Session(engine) as db, db.begin():
+            upsert(
+                db,
+                CollectorMember,
+                [dict(id=self.member_id, heartbeat=now)],
+                ["id"],
+                update_columns=["heartbeat"],
+            )
+            db.execute(
+                delete(CollectorMember).where(
+                    CollectorMember.heartbeat < now - self.lease * 10
+                )
+            )
+            members = db.scalars(
+                select(CollectorMember.id).where(
+                    CollectorMember.heartbeat >= now - self.lease
+                )
+            ).all()
+            share = [
+                location
+                for location in set(locations)
+                if rendezvous_owner(location, members) == self.member_id
+            ]
+            db.execute(
+                delete(LocationLease).where(
+                    LocationLease.owner == self.member_id,
+                    LocationLease.location.not_in(share),
+                )
+            )
+            upsert(
+                db,
+                LocationLease,
+                [
+                    dict(
+                        location=location,
+                        owner=self.member_id,
+                        expires=now + self.lease,
+                    )
+                    for location in share
+                ],
+                ["location"],
+                update_columns=["owner", "expires"],
+                where=(LocationLease.owner == self.member_id)
+                | (LocationLease.expires < now),
+            )
+            owned = db.scalars(
+                select(LocationLease.location).where(
+                    LocationLease.owner == self.member_id
+                )
+            ).all()
+        logger.debug(
+            f"{len(members)} collectors live, {self.member_id} owns {len(owned)} of {len(share)} locations in its share"
+        )
+        return set(owned)
+
+    def release(self):
+        with Session(engine) as db, db.begin():
+            db.execute(
+                delete(LocationLease).where(LocationLease.owner == self.member_id)
+            )
+            db.execute(
+                delete(CollectorMember).where(CollectorMember.id == self.member_id)
+            )
+        logger.info(f"Released the leases of {self.member_id}")
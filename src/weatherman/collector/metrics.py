@@ -0,0 +1,64 @@
+import logging
+
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+# Everything the collector measures, exposed in Prometheus format when METRICS_PORT
+# is set. Updating a metric is cheap, so they are kept up to date either way
+
+FETCH_SECONDS = Histogram(
+    "weatherman_fetch_seconds",
+    "Time taken by one request to the weather API, bulk requests are labelled bulk",
+    ["location", "status"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+FETCH_RETRIES = Counter(
+    "weatherman_fetch_retries",
+    "Requests to the weather API that were retried",
+    ["status"],
+)
+PARSE_SECONDS = Histogram(
+    "weatherman_parse_seconds",
+    "Time taken to decode a weather API response",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05),
+)
+WRITE_SECONDS = Histogram(
+    "weatherman_write_seconds",
+    "Time taken to save one batch of responses to the database",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+)
+WRITE_FAILURES = Counter(
+    "weatherman_write_failures",
+    "Responses that could not be saved to the database",
+)
+WRITE_QUEUE_DEPTH = Gauge(
+    "weatherman_write_queue_depth",
+    "Responses waiting for the database writer",
+)
+ROWS_WRITTEN = Counter(
+    "weatherman_rows_written",
+    "Rows inserted into the weather database",
+    ["table"],
+)
+ROWS_EXISTING = Counter(
+    "weatherman_rows_existing",
+    "Rows skipped by the database because they were already stored",
+    ["table"],
+)
+UNCHANGED = Counter(
+    "weatherman_unchanged",
+    "Parts of responses not sent to the database because they did not change",
+    ["part"],
+)
+SCHEDULER_LAG = Histogram(
+    "weatherman_scheduler_lag_seconds",
+    "Delay between the planned and the actual start of a fetch job",
+    buckets=(0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300),
+)
+
+
+def serve(port):
+    start_http_server(port)
+    logger.info(f"Serving metrics on port {port}")
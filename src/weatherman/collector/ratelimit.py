@@ -0,0 +1,41 @@
+import asyncio
+import random
+import time
+
+
+class TokenBucket:
+    # Global request budget shared by every fetch. A rate of 0 disables the limit.
+    # Requests costing more than the bucket holds (bulk requests) wait for a full
+    # bucket and leave it in debt, so the long term rate is still respected
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self, tokens=1):
+        if not self.rate:
+            return
+        needed = min(tokens, self.capacity)
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= needed:
+                    self.tokens -= tokens
+                    return
+                await asyncio.sleep((needed - self.tokens) / self.rate)
+
+
+def backoff_delay(attempt, base, maximum, retry_after=None):
+    # Exponential backoff with full jitter, but never sooner than the API asked for.
+    # A Retry-After beyond the maximum is capped, so a bogus one cannot stall a
+    # fetch for hours
+    delay = random.uniform(0, min(maximum, base * 2**attempt))
+    if retry_after:
+        delay = max(delay, min(retry_after, maximum))
+    return delay
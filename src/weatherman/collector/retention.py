@@ -0,0 +1,147 @@
+import logging
+import time
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import delete, func, select, text
+from sqlmodel import Session
+
+from src.weatherman.db import dialect_insert, engine
+from src.weatherman.migrations import PARTITIONED_TABLES, add_months, partitions
+from src.weatherman.ormodels import (
+    Astro,
+    CurrentWeather,
+    Daily,
+    DailyRollup,
+    Forecast,
+    Hourly,
+    HourlyRollup,
+)
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+ROLLUP_METRICS = (
+    "temp_c",
+    "feelslike_c",
+    "humidity",
+    "pressure_mb",
+    "wind_kph",
+    "gust_kph",
+    "precip_mm",
+    "cloud",
+    "uv",
+)
+
+
+def period_start(column, period, dialect):
+    if dialect == "sqlite":
+        # Same text as SQLAlchemy stores datetimes in, so they compare and conflict
+        pattern = (
+            "%Y-%m-%d %H:00:00.000000"
+            if period == "hour"
+            else "%Y-%m-%d 00:00:00.000000"
+        )
+        return func.strftime(pattern, column)
+    return func.date_trunc(period, column)
+
+
+def rollup(db, model, period, start, end):
+    # Aggregates the observations in [start, end) into one row per location and
+    # period. Periods that are already rolled up are skipped, their raw rows may be
+    # partly deleted by now
+    dialect = db.get_bind().dialect.name
+    started = period_start(CurrentWeather.last_updated, period, dialect)
+    columns = [
+        started.label("period_start"),
+        CurrentWeather.location_id,
+        func.count().label("samples"),
+    ]
+    for metric in ROLLUP_METRICS:
+        column = getattr(CurrentWeather, metric)
+        columns += [
+            func.min(column).label(f"{metric}_min"),
+            func.max(column).label(f"{metric}_max"),
+            func.avg(column).label(f"{metric}_avg"),
+        ]
+    aggregate = (
+        select(*columns)
+        .where(CurrentWeather.last_updated >= start)
+        .where(CurrentWeather.last_updated < end)
+        .group_by(started, CurrentWeather.location_id)
+    )
+    stmt = (
+        dialect_insert(db, model)
+        .from_select([column.name for column in columns], aggregate)
+        .on_conflict_do_nothing(index_elements=["location_id", "period_start"])
+    )
+    return db.execute(stmt).rowcount
+
+
+def delete_in_batches(model, condition, batch_size, children=()):
+    # Small transactions keep the database lock short, so the collector keeps
+    # writing in between. Rows of children referencing a deleted row go first
+    deleted = 0
+    while True:
+        with Session(engine) as db, db.begin():
+            ids = db.scalars(select(model.id).where(condition).limit(batch_size)).all()
+            if not ids:
+                return deleted
+            for child in children:
+                db.execute(delete(child).where(child.forecast_id.in_(ids)))
+            db.execute(delete(model).where(model.id.in_(ids)))
+            deleted += len(ids)
+
+
+def drop_partitions(cutoff):
+    # On PostgreSQL, months entirely before the cutoff are dropped as a whole
+    dropped = []
+    with Session(engine) as db, db.begin():
+        if db.get_bind().dialect.name != "postgresql":
+            return dropped
+        for table in PARTITIONED_TABLES:
+            for month, name in partitions(db.connection(), table).items():
+                if add_months(month, 1) <= cutoff:
+                    db.execute(text(f"DROP TABLE {name}"))
+                    dropped.append(name)
+    return dropped
+
+
+def apply_retention(retention_days, batch_size):
+    # Rolls every day of observations older than retention_days up into hourly and
+    # daily aggregates, then deletes those observations and the forecasts for days
+    # before it. Timestamps are the locations' local time, as sent by weatherapi.com
+    started = time.perf_counter()
+    today = datetime.now(timezone.utc).replace(
+        tzinfo=None, hour=0, minute=0, second=0, microsecond=0
+    )
+    cutoff = today - timedelta(days=retention_days)
+    with Session(engine) as db:
+        oldest = db.scalar(select(func.min(CurrentWeather.last_updated)))
+
+    hours = days = 0
+    if oldest is not None:
+        day = oldest.replace(hour=0, minute=0, second=0, microsecond=0)
+        while day < cutoff:
+            with Session(engine) as db, db.begin():
+                end = day + timedelta(days=1)
+                hours += rollup(db, HourlyRollup, "hour", day, end)
+                days += rollup(db, DailyRollup, "day", day, end)
+            day += timedelta(days=1)
+
+    dropped = drop_partitions(cutoff)
+    observations = delete_in_batches(
+        CurrentWeather, CurrentWeather.last_updated < cutoff, batch_size
+    )
+    # Each forecast comes with 24 hourly rows, keep the batches about the same size
+    forecasts = delete_in_batches(
+        Forecast,
+        Forecast.date < cutoff,
+        max(batch_size // 24, 1),
+        children=(Hourly, Daily, Astro),
+    )
+    logger.info(
+        f"Retention before {cutoff:%Y-%m-%d}: rolled up {hours} hours and {days} days, "
+        f"dropped {len(dropped)} partitions, "
+        f"deleted {observations} observations and {forecasts} forecasts in "
+        f"{time.perf_counter() - started:.1f}s"
+    )
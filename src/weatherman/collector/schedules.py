@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+
+from apscheduler import current_job
+from apscheduler.triggers.interval import IntervalTrigger
+from sqlalchemy.exc import SQLAlchemyError
+
+from src.weatherman.collector import metrics
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+
+def validate_configuration_line(location, interval):
+    if not isinstance(location, str) or not location:
+        return False
+    if not interval.isdigit():
+        return False
+    return True
+
+
+def parse_locations(lines):
+    locations = []
+    for item in lines:
+        if not item.strip():
+            continue
+        location, _, interval_minutes = item.strip().rpartition(",")
+        if not validate_configuration_line(location, interval_minutes):
+            logger.error(f"Invalid configuration line: {item}")
+            continue
+        locations.append((location, int(interval_minutes)))
+    return locations
+
+
+def batch_locations(locations, batch_size):
+    # Locations sharing an interval are fetched together, batch_size at a time. The
+    # batches of an interval get start offsets spread evenly across it, so they do
+    # not all hit the API and the database at the same moment
+    by_interval = {}
+    for location, interval_minutes in locations:
+        by_interval.setdefault(interval_minutes, []).append(location)
+    for interval_minutes, interval_locations in by_interval.items():
+        batches = [
+            interval_locations[start : start + batch_size]
+            for start in range(0, len(interval_locations), batch_size)
+        ]
+        for index, batch in enumerate(batches):
+            offset = timedelta(minutes=interval_minutes) * index / len(batches)
+            yield interval_minutes, batch, offset
+
+
+def schedule_id(interval_minutes, batch):
+    # Stable across reloads, so an unchanged batch keeps its schedule and next run
+    return f"weather:{interval_minutes}:{'|'.join(batch)}"
+
+
+class LocationSchedules:
+    # Keeps one scheduler entry per batch of locations. sync() only adds and
+    # removes the entries that differ from the wanted set, so the other
+    # schedules, and any fetch already running, are left alone. With leases, only
+    # the locations this instance holds a lease for are scheduled
+    def __init__(self, scheduler, fetch, batch_size, leases=None):
+        self.scheduler = scheduler
+        self.fetch = fetch
+        self.batch_size = batch_size
+        self.leases = leases
+        self.locations = []
+        self.schedules = {}
+        self.renewed = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def sync(self, locations):
+        self.locations = locations
+        async with self.lock:
+            locations = await self.owned_locations()
+            if locations is None:
+                return 0, 0
+            return await self.apply(locations)
+
+    async def owned_locations(self):
+        if self.leases is None:
+            return self.locations
+        try:
+            owned = await asyncio.to_thread(
+                self.leases.renew, [location for location, _ in self.locations]
+            )
+            self.renewed = time.monotonic()
+        except SQLAlchemyError as e:
+            logger.error(f"Could not renew location leases: {e}")
+            if time.monotonic() - self.renewed < self.leases.lease.total_seconds():
+                # Our leases are still valid, keep fetching what we have
+                return None
+            # They may have been taken over by now, stop before fetching twice
+            owned = set()
+        return [
+            (location, interval_minutes)
+            for location, interval_minutes in self.locations
+            if location in owned
+        ]
+
+    async def fetch_batch(self, batch, data_type):
+        job = current_job.get()
+        if job.scheduled_fire_time:
+            planned = job.scheduled_fire_time + job.jitter
+            metrics.SCHEDULER_LAG.observe(
+                (datetime.now(timezone.utc) - planned).total_seconds()
+            )
+        await self.fetch(batch, data_type)
+
+    async def rebalance(self):
+        added, removed = await self.sync(self.locations)
+        if added or removed:
+            logger.info(
+                f"Rebalanced locations: {added} schedules added, {removed} removed"
+            )
+
+    async def apply(self, locations):
+        wanted = {}
+        for interval_minutes, batch, offset in batch_locations(
+            locations, self.batch_size
+        ):
+            wanted[schedule_id(interval_minutes, batch)] = (
+                interval_minutes,
+                batch,
+                offset,
+            )
+        removed = self.schedules.keys() - wanted.keys()
+        added = wanted.keys() - self.schedules.keys()
+        for id in removed:
+            interval_minutes, batch, _ = self.schedules.pop(id)
+            logger.info(
+                f"Removing schedule for {', '.join(batch)}, with interval {interval_minutes} minutes"
+            )
+            await self.scheduler.remove_schedule(id)
+        now = datetime.now(timezone.utc)
+        for id in added:
+            interval_minutes, batch, offset = wanted[id]
+            logger.info(
+                f"Adding schedule for {', '.join(batch)}, with interval {interval_minutes} minutes"
+            )
+            await self.scheduler.add_schedule(
+                self.fetch_batch,
+                id=id,
+                args=[batch, "forecast"],
+                trigger=IntervalTrigger(
+                    minutes=interval_minutes, start_time=now + offset
+                ),
+            )
+            self.schedules[id] = wanted[id]
+        return len(added), len(removed)
+
+    async def reload(self, location_file):
+        try:
+            if not location_file.changed():
+                return
+            locations = location_file.read()
+        except OSError as e:
+            logger.error(f"Could not read location file {location_file.path}: {e}")
+            return
+        if not locations:
+            # Most likely caught mid-save, keep what is scheduled
+            logger.warning(f"No locations in {location_file.path}, keeping schedules")
+            return
+        added, removed = await self.sync(locations)
+        logger.info(
+            f"Reloaded {location_file.path}: {added} schedules added, {removed} removed"
+        )
+
+
+class LocationFile:
+    # Re-reads the location file whenever its modification time or size changes
+    def __init__(self, path):
+        self.path = path
+        self.stamp = None
+
+    def changed(self):
+        stat = os.stat(self.path)
+        stamp = (stat.st_mtime_ns, stat.st_size)
+        if stamp == self.stamp:
+            return False
+        self.stamp = stamp
+        return True
+
+    def read(self):
+        with open(self.path, "r") as f:
+            return parse_locations(f.readlines())
@@ -0,0 +1,227 @@
+from datetime import datetime
+from functools import lru_cache
+from typing import Optional, Union
+
+import msgspec
+
+from src.weatherman.ormodels import (
+    Astro,
+    CurrentWeather,
+    Daily,
+    Hourly,
+    Location,
+)
+
+# Typed view of weatherapi.com responses. Only the fields that are stored are
+# declared, msgspec skips everything else while decoding
+
+
+class ConditionData(msgspec.Struct):
+    text: str
+    icon: str
+    code: int
+
+
+class LocationData(msgspec.Struct):
+    name: str
+    region: str
+    country: str
+    lat: float
+    lon: float
+    tz_id: str
+
+
+class CurrentData(msgspec.Struct):
+    last_updated: str
+    temp_c: float
+    temp_f: float
+    is_day: int
+    condition: ConditionData
+    wind_mph: float
+    wind_kph: float
+    wind_degree: int
+    wind_dir: str
+    pressure_mb: float
+    pressure_in: float
+    precip_mm: float
+    precip_in: float
+    humidity: int
+    cloud: int
+    feelslike_c: float
+    feelslike_f: float
+    vis_km: float
+    vis_miles: float
+    uv: float
+    gust_mph: float
+    gust_kph: float
+
+
+class DayData(msgspec.Struct):
+    maxtemp_c: float
+    maxtemp_f: float
+    mintemp_c: float
+    mintemp_f: float
+    avgtemp_c: float
+    avgtemp_f: float
+    maxwind_mph: float
+    maxwind_kph: float
+    totalprecip_mm: float
+    totalprecip_in: float
+    totalsnow_cm: float
+    avgvis_km: float
+    avgvis_miles: float
+    avghumidity: float
+    daily_will_it_rain: int
+    daily_chance_of_rain: int
+    daily_will_it_snow: int
+    daily_chance_of_snow: int
+    condition: ConditionData
+    uv: float
+
+
+class AstroData(msgspec.Struct):
+    sunrise: str
+    sunset: str
+    moonrise: str
+    moonset: str
+    moon_phase: str
+    moon_illumination: Union[int, str]
+    is_moon_up: int
+    is_sun_up: int
+
+
+class HourData(msgspec.Struct):
+    time: str
+    temp_c: float
+    temp_f: float
+    is_day: int
+    condition: ConditionData
+    wind_mph: float
+    wind_kph: float
+    wind_degree: int
+    wind_dir: str
+    pressure_mb: float
+    pressure_in: float
+    precip_mm: float
+    precip_in: float
+    snow_cm: float
+    humidity: int
+    cloud: int
+    feelslike_c: float
+    feelslike_f: float
+    windchill_c: float
+    windchill_f: float
+    heatindex_c: float
+    heatindex_f: float
+    dewpoint_c: float
+    dewpoint_f: float
+    will_it_rain: int
+    chance_of_rain: int
+    will_it_snow: int
+    chance_of_snow: int
+    vis_km: float
+    vis_miles: float
+    gust_mph: float
+    gust_kph: float
+    uv: float
+
+
+class ForecastDayData(msgspec.Struct):
+    date: str
+    day: DayData
+    astro: AstroData
+    hour: list[HourData]
+
+
+class ForecastData(msgspec.Struct):
+    forecastday: list[ForecastDayData] = []
+
+
+class WeatherData(msgspec.Struct):
+    location: LocationData
+    current: Optional[CurrentData] = None
+    forecast: ForecastData = msgspec.field(default_factory=ForecastData)
+
+
+class ApiErrorData(msgspec.Struct):
+    code: int
+    message: str
+
+
+class BulkQueryData(msgspec.Struct):
+    q: str
+    custom_id: Optional[str] = None
+    error: Optional[ApiErrorData] = None
+    location: Optional[LocationData] = None
+    current: Optional[CurrentData] = None
+    forecast: ForecastData = msgspec.field(default_factory=ForecastData)
+
+
+class BulkItemData(msgspec.Struct):
+    # Kept raw, so every location's part of the response can be archived as is
+    query: msgspec.Raw
+
+
+class BulkData(msgspec.Struct):
+    bulk: list[BulkItemData] = []
+
+
+class ArchiveRecordData(msgspec.Struct):
+    fetched_at: str
+    location: str
+    response: WeatherData
+
+
+weather_decoder = msgspec.json.Decoder(WeatherData)
+bulk_decoder = msgspec.json.Decoder(BulkData)
+bulk_query_decoder = msgspec.json.Decoder(BulkQueryData)
+archive_decoder = msgspec.json.Decoder(ArchiveRecordData)
+
+
+# The same timestamps come back in every response of the day, parse each only once
+@lru_cache(maxsize=4096)
+def parse_time(value):
+    return datetime.strptime(value, "%Y-%m-%d %H:%M")
+
+
+@lru_cache(maxsize=1024)
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d")
+
+
+def check_times(data):
+    # Raises ValueError for a timestamp the row mappings could not parse, so a bad
+    # response is refused when it is fetched rather than when its batch is written
+    if data.current:
+        parse_time(data.current.last_updated)
+    for forecast_data in data.forecast.forecastday:
+        parse_date(forecast_data.date)
+        for hour_data in forecast_data.hour:
+            parse_time(hour_data.time)
+
+
+class RowMapping:
+    # Maps a decoded struct onto the columns of an ORM model. Every struct field
+    # with a column of the same name is copied, converters transform values on the
+    # way, and anything else (ids, foreign keys) is passed in when building the row
+    def __init__(self, model, struct_type, **converters):
+        self.columns = tuple(
+            name
+            for name in struct_type.__struct_fields__
+            if name in model.__table__.columns
+        )
+        self.converters = converters
+
+    def row(self, data, **extra):
+        row = {name: getattr(data, name) for name in self.columns}
+        for name, convert in self.converters.items():
+            row[name] = convert(row[name])
+        row.update(extra)
+        return row
+
+
+LOCATION = RowMapping(Location, LocationData)
+CURRENT_WEATHER = RowMapping(CurrentWeather, CurrentData, last_updated=parse_time)
+DAILY = RowMapping(Daily, DayData)
+ASTRO = RowMapping(Astro, AstroData, moon_illumination=str)
+HOURLY = RowMapping(Hourly, HourData, time=parse_time)
@@ -1,256 +1,589 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from functools import partial
+
 import httpx
-from sqlalchemy import Select, and_
-from sqlalchemy.exc import SQLAlchemyError, IntegrityError
+import msgspec
+from sqlalchemy import delete
 from sqlmodel import Session
 
 import constants
-from datetime import datetime
 from src.weatherman.ormodels import (
-    Location,
     CurrentWeather,
-    Condition,
     Forecast,
     Daily,
     Astro,
     Hourly,
+    LatestCurrent,
+    LatestForecast,
+    LocationVersion,
 )
-from src.weatherman.db import engine, save_to_db
+from src.weatherman.db import dialect_insert, engine, upsert
+from src.weatherman.collector.cache import conditions, locations
+from src.weatherman.collector.changes import ChangeDetector
+from src.weatherman.collector.ratelimit import TokenBucket, backoff_delay
+from src.weatherman.collector.writer import IngestWriter
+from src.weatherman.collector import schema
+from src.weatherman.collector import metrics
 import logging
 
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 
 
+class WeatherApiError(ValueError):
+    def __init__(self, message, status_code=None, retry_after=None):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+    @property
+    def retriable(self):
+        # Rate limiting, server errors and network errors (no status) are worth
+        # another try, anything else is a problem with the request itself
+        return (
+            self.status_code is None
+            or self.status_code == 429
+            or self.status_code >= 500
+        )
+
+
+def retry_after_seconds(response):
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def bulk_location(locations, custom_id):
+    # The requested location a bulk answer belongs to, None when its custom_id is
+    # missing or not one that was sent
+    try:
+        index = int(custom_id)
+    except (TypeError, ValueError):
+        return None
+    if 0 <= index < len(locations):
+        return locations[index]
+    return None
+
+
 class WeatherApi:
-    def __init__(self, api_key):
+    def __init__(
+        self,
+        api_key,
+        max_concurrent_fetches=constants.MAX_CONCURRENT_FETCHES,
+        timeout=constants.HTTP_TIMEOUT_SECONDS,
+        max_connections=constants.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=constants.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        language=constants.DEFAULT_LANGUAGE,
+        forecast_days=constants.FORECAST_DAYS,
+        rate_limit=None,
+        retries=constants.FETCH_RETRIES,
+        retry_base=constants.RETRY_BASE_SECONDS,
+        retry_max=constants.RETRY_MAX_SECONDS,
+        write_queue_size=constants.WRITE_QUEUE_SIZE,
+        write_batch_size=constants.WRITE_BATCH_SIZE,
+        write_flush_seconds=constants.WRITE_FLUSH_SECONDS,
+        archive=None,
+        transport=None,
+    ):
         self.api_key = api_key
+        self.language = language
+        self.forecast_days = forecast_days
+        # One long-lived client for the whole process, so connections (and their
+        # TLS sessions) are reused across schedules instead of per request. Tests pass
+        # a transport that stands in for weatherapi.com
+        self.client = httpx.AsyncClient(
+            transport=transport,
+            base_url=constants.BASE_URL,
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_keepalive_connections,
+            ),
+            timeout=httpx.Timeout(timeout),
+        )
+        self.fetch_limit = asyncio.Semaphore(max_concurrent_fetches)
+        self.rate_limit = rate_limit or TokenBucket(0, 0)
+        self.retries = retries
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.changes = ChangeDetector()
+        self.archive = archive
+        self.writer = IngestWriter(
+            partial(save_many_from_json, language=language),
+            on_commit=self.changes.remember,
+            max_queue=write_queue_size,
+            batch_size=write_batch_size,
+            flush_seconds=write_flush_seconds,
+        )
+
+    async def __aenter__(self):
+        self.writer.start()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
+
+    async def aclose(self):
+        await self.writer.close()
+        await self.client.aclose()
+        if self.archive:
+            self.archive.close()
 
-    def fetch_and_save_weather(self, location, data_type):
-        url = f"{constants.BASE_URL}/{data_type}.json?key={self.api_key}&q={location}"
-        logger.debug(f"Trying URL: {url}")
-        with httpx.Client() as client:
-            response = client.get(url)
+    def params(self, location, data_type):
+        params = {"key": self.api_key, "q": location}
+        if data_type == "forecast":
+            params["days"] = self.forecast_days
+        if self.language != constants.DEFAULT_LANGUAGE:
+            params["lang"] = self.language
+        return params
+
+    async def request(self, method, url, location, cost=1, **kwargs):
+        # Every attempt takes `cost` calls from the API budget. Backoff sleeps happen
+        # outside the fetch semaphore, so a failing location never holds up others
+        for attempt in range(self.retries + 1):
+            await self.rate_limit.acquire(cost)
+            try:
+                async with self.fetch_limit:
+                    started = time.perf_counter()
+                    try:
+                        response = await self.client.request(method, url, **kwargs)
+                    except httpx.TransportError:
+                        metrics.FETCH_SECONDS.labels(location, "error").observe(
+                            time.perf_counter() - started
+                        )
+                        raise
+                    metrics.FETCH_SECONDS.labels(
+                        location, response.status_code
+                    ).observe(time.perf_counter() - started)
+                response.raise_for_status()
+                logger.debug(
+                    f"Got successful response from weather API: {response.status_code}"
+                )
+                return response
+            except httpx.HTTPStatusError as e:
+                error = WeatherApiError(
+                    f"Failed to get data from weather API: {e}",
+                    status_code=e.response.status_code,
+                    retry_after=retry_after_seconds(e.response),
+                )
+            except httpx.TransportError as e:
+                error = WeatherApiError(f"Failed to reach weather API: {e!r}")
+            if not error.retriable or attempt == self.retries:
+                raise error
+            delay = backoff_delay(
+                attempt, self.retry_base, self.retry_max, error.retry_after
+            )
+            logger.warning(f"{error}, retrying in {delay:.1f} seconds")
+            metrics.FETCH_RETRIES.labels(error.status_code or "error").inc()
+            await asyncio.sleep(delay)
+
+    def decode(self, decoder, response, content=None):
         try:
-            response.raise_for_status()
-        except httpx.HTTPStatusError as e:
-            raise ValueError(f"Failed to get data from weather API: {e}")
-        logger.debug(
-            f"Got successful response from weather API: {response.status_code}"
+            return decoder.decode(response.content if content is None else content)
+        except msgspec.MsgspecError as e:
+            raise WeatherApiError(
+                f"Unexpected response from weather API: {e}",
+                status_code=response.status_code,
+            )
+
+    def check(self, data, response):
+        try:
+            schema.check_times(data)
+        except ValueError as e:
+            raise WeatherApiError(
+                f"Unexpected response from weather API: {e}",
+                status_code=response.status_code,
+            )
+
+    async def archive_response(self, location, raw):
+        if self.archive:
+            await asyncio.to_thread(self.archive.append, location, raw)
+
+    async def fetch_weather(self, location, data_type):
+        logger.debug(f"Fetching {data_type} data for {location}")
+        response = await self.request(
+            "GET",
+            f"/{data_type}.json",
+            location,
+            params=self.params(location, data_type),
         )
-        logger.debug(f"Trying to save response to DB")
-        return save_orm_from_json(response.json())
-
-
-def save_orm_from_json(json_data):
-
-    db = Session(engine)
-    data = json_data
-    # Create Location instance
-    location_data = data["location"]
-    location = Location(
-        name=location_data["name"],
-        region=location_data["region"],
-        country=location_data["country"],
-        lat=location_data["lat"],
-        lon=location_data["lon"],
-        tz_id=location_data["tz_id"],
-    )
-    try:
-        db.add(location)
-        db.commit()
-        logger.debug(f"Location {location.name} added to database")
-    except IntegrityError:
-        logging.debug(f"Skipping saving location to database, data already exists")
-        db.rollback()
-        logger.debug(f"Location {location.name} already exists in database, retrieving")
-        lc_select = Select(Location).where(
-            and_(
-                Location.name == location.name,
-                Location.region == location.region,
-                Location.country == location.country,
+        with metrics.PARSE_SECONDS.time():
+            data = self.decode(schema.weather_decoder, response)
+            self.check(data, response)
+        await self.archive_response(location, response.content)
+        return data
+
+    async def fetch_bulk_weather(self, locations, data_type):
+        # Bulk requests return one query object per location, matched back to the
+        # requested location by custom_id. Locations that failed are left out
+        logger.debug(f"Fetching {data_type} data for {len(locations)} locations")
+        body = {
+            "locations": [
+                {"q": location, "custom_id": str(index)}
+                for index, location in enumerate(locations)
+            ]
+        }
+        # weatherapi.com counts every location in a bulk request as one call
+        response = await self.request(
+            "POST",
+            f"/{data_type}.json",
+            "bulk",
+            cost=len(locations),
+            params=self.params("bulk", data_type),
+            json=body,
+        )
+        results = {}
+        with metrics.PARSE_SECONDS.time():
+            items = self.decode(schema.bulk_decoder, response).bulk
+            queries = [
+                self.decode(schema.bulk_query_decoder, response, item.query)
+                for item in items
+            ]
+        for item, query in zip(items, queries):
+            if query.error or query.location is None:
+                logger.warning(f"Bulk request failed for {query.q}: {query.error}")
+                continue
+            location = bulk_location(locations, query.custom_id)
+            if location is None:
+                logger.warning(
+                    f"Bulk request returned unknown custom_id {query.custom_id!r} "
+                    f"for {query.q}"
+                )
+                continue
+            try:
+                schema.check_times(query)
+            except ValueError as e:
+                logger.warning(f"Bulk request returned bad data for {query.q}: {e}")
+                continue
+            results[location] = schema.WeatherData(
+                location=query.location,
+                current=query.current,
+                forecast=query.forecast,
             )
+            await self.archive_response(location, bytes(item.query))
+        return results
+
+    async def save_weather(self, data):
+        changes = self.changes.detect(data)
+        if changes is None:
+            logger.debug(f"Writes avoided so far: {self.changes.skipped}")
+            return
+        logger.debug(f"Queueing response for {data.location.name}")
+        await self.writer.put(changes)
+
+    async def fetch_and_save_weather(self, location, data_type):
+        data = await self.fetch_weather(location, data_type)
+        return await self.save_weather(data)
+
+    async def fetch_and_save_bulk_weather(self, locations, data_type):
+        results = {}
+        if len(locations) > 1:
+            try:
+                results = await self.fetch_bulk_weather(locations, data_type)
+            except WeatherApiError as e:
+                logger.warning(f"Bulk request failed, using single requests: {e}")
+        for data in results.values():
+            await self.save_weather(data)
+
+        # Anything the bulk request did not return is fetched on its own
+        missing = [location for location in locations if location not in results]
+        outcomes = await asyncio.gather(
+            *(self.fetch_and_save_weather(location, data_type) for location in missing),
+            return_exceptions=True,
+        )
+        for location, outcome in zip(missing, outcomes):
+            if isinstance(outcome, Exception):
+                logger.error(
+                    f"Failed to fetch and save weather for {location}: {outcome}"
+                )
+
+
+def condition_rows(data, language):
+    # Daily conditions have no is_day flag, weatherapi.com gives them day icons
+    conditions = []
+    if data.current:
+        conditions.append((data.current.condition, data.current.is_day))
+    for forecast_data in data.forecast.forecastday:
+        conditions.append((forecast_data.day.condition, 1))
+        for hour_data in forecast_data.hour:
+            conditions.append((hour_data.condition, hour_data.is_day))
+    return {
+        (condition.code, is_day, language): dict(
+            code=condition.code,
+            is_day=is_day,
+            language=language,
+            text=condition.text,
+            icon=condition.icon,
         )
-        location = db.exec(lc_select).one_or_none()[0]
-
-    # Create Condition instance for current weather
-    current_condition_data = data["current"]["condition"]
-    current_condition = Condition(
-        text=current_condition_data["text"],
-        icon=current_condition_data["icon"],
-        code=current_condition_data["code"],
+        for condition, is_day in conditions
+    }
+
+
+def latest_details(location_data, condition_data):
+    # Location and condition columns of the latest state tables
+    details = {
+        f"location_{name}": value
+        for name, value in schema.LOCATION.row(location_data).items()
+    }
+    details.update(
+        condition_code=condition_data.code,
+        condition_text=condition_data.text,
+        condition_icon=condition_data.icon,
     )
+    return details
+
+
+def replaced_columns(model, conflict_columns):
+    # Columns overwritten when a row is stored again: all but its id and the columns
+    # it is found by
+    return [
+        column
+        for column in model.__table__.columns.keys()
+        if column != "id" and column not in conflict_columns
+    ]
 
-    # Create CurrentWeather instance
-    current_weather_data = data["current"]
-    current_weather = CurrentWeather(
-        location_id=location.id,
-        last_updated=datetime.strptime(
-            current_weather_data["last_updated"], "%Y-%m-%d %H:%M"
-        ),
-        temp_c=current_weather_data["temp_c"],
-        temp_f=current_weather_data["temp_f"],
-        is_day=current_weather_data["is_day"],
-        wind_mph=current_weather_data["wind_mph"],
-        wind_kph=current_weather_data["wind_kph"],
-        wind_degree=current_weather_data["wind_degree"],
-        wind_dir=current_weather_data["wind_dir"],
-        pressure_mb=current_weather_data["pressure_mb"],
-        pressure_in=current_weather_data["pressure_in"],
-        precip_mm=current_weather_data["precip_mm"],
-        precip_in=current_weather_data["precip_in"],
-        humidity=current_weather_data["humidity"],
-        cloud=current_weather_data["cloud"],
-        feelslike_c=current_weather_data["feelslike_c"],
-        feelslike_f=current_weather_data["feelslike_f"],
-        vis_km=current_weather_data["vis_km"],
-        vis_miles=current_weather_data["vis_miles"],
-        uv=current_weather_data["uv"],
-        gust_mph=current_weather_data["gust_mph"],
-        gust_kph=current_weather_data["gust_kph"],
-        condition=current_condition,
+
+def update_latest(db, model, rows, time_column):
+    # Keeps the newest row per location. A location's row is only ever replaced by
+    # a newer one, so replaying old responses does not move it back in time. Returns
+    # the ids of locations whose row changed
+    latest = {}
+    for row in rows:
+        previous = latest.get(row["location_id"])
+        if previous is None or previous[time_column] < row[time_column]:
+            latest[row["location_id"]] = row
+    changed = upsert(
+        db,
+        model,
+        list(latest.values()),
+        ["location_id"],
+        update_columns=[
+            column
+            for column in model.__table__.columns.keys()
+            if column != "location_id"
+        ],
+        where=lambda excluded: getattr(model, time_column) < excluded[time_column],
+        returning=["location_id"],
     )
-    try:
-        logger.debug(f"Adding current weather data to database")
-        db.add(current_weather)
-        db.commit()
-        logging.debug(f"Current weather data added to database")
-    except SQLAlchemyError as e:
-        logger.debug(
-            f"Skipping saving current weather data to database, data already exists"
+    return {row.location_id for row in changed}
+
+
+def update_latest_forecast(db, rows):
+    # Keeps one row per location and forecast date, replaced whenever the day is
+    # stored again, so the API finds today's newest forecast of every location.
+    # Dates before yesterday (UTC) are no location's today any more and are dropped.
+    # Returns the ids of locations whose rows changed
+    changed = {
+        row.location_id
+        for row in upsert(
+            db,
+            LatestForecast,
+            rows,
+            ["location_id", "date"],
+            update_columns=replaced_columns(LatestForecast, ["location_id", "date"]),
+            returning=["location_id"],
+        )
+    }
+    if changed:
+        today = datetime.now(timezone.utc).replace(
+            tzinfo=None, hour=0, minute=0, second=0, microsecond=0
         )
-        db.rollback()
+        db.execute(
+            delete(LatestForecast)
+            .where(
+                LatestForecast.location_id.in_(changed),
+                LatestForecast.date < today - timedelta(days=1),
+            )
+            .execution_options(synchronize_session=False)
+        )
+    return changed
+
 
-    # Create Forecast instance
-    forecast_data = data["forecast"]["forecastday"][0]
-    forecast = Forecast(
-        date=datetime.strptime(forecast_data["date"], "%Y-%m-%d"),
-        location_id=location.id,
+def bump_versions(db, location_ids):
+    # Tells the API that its cached responses for these locations are out of date.
+    # Sorted, so concurrent writers lock the rows in the same order
+    if not location_ids:
+        return
+    stmt = dialect_insert(db, LocationVersion)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["location_id"],
+        set_={"version": LocationVersion.version + 1},
     )
-    try:
-        logger.debug(f"Adding forecast data to database")
-        db.add(forecast)
-        db.commit()
-    except IntegrityError:
-        logger.debug(f"Skipping saving forecast data to database, data already exists")
-        db.rollback()
-        fc_select = Select(Forecast).where(
-            and_(Forecast.location_id == location.id, Forecast.date == forecast.date)
-        )
-        forecast = db.exec(fc_select).one_or_none()[0]
-
-    # Create Daily instance
-    daily_data = forecast_data["day"]
-    daily_condition_data = daily_data["condition"]
-    daily_condition = Condition(
-        text=daily_condition_data["text"],
-        icon=daily_condition_data["icon"],
-        code=daily_condition_data["code"],
+    db.execute(
+        stmt,
+        [
+            dict(location_id=location_id, version=1)
+            for location_id in sorted(location_ids)
+        ],
     )
-    daily = Daily(
-        maxtemp_c=daily_data["maxtemp_c"],
-        maxtemp_f=daily_data["maxtemp_f"],
-        mintemp_c=daily_data["mintemp_c"],
-        mintemp_f=daily_data["mintemp_f"],
-        avgtemp_c=daily_data["avgtemp_c"],
-        avgtemp_f=daily_data["avgtemp_f"],
-        maxwind_mph=daily_data["maxwind_mph"],
-        maxwind_kph=daily_data["maxwind_kph"],
-        totalprecip_mm=daily_data["totalprecip_mm"],
-        totalprecip_in=daily_data["totalprecip_in"],
-        totalsnow_cm=daily_data["totalsnow_cm"],
-        avgvis_km=daily_data["avgvis_km"],
-        avgvis_miles=daily_data["avgvis_miles"],
-        avghumidity=daily_data["avghumidity"],
-        daily_will_it_rain=daily_data["daily_will_it_rain"],
-        daily_chance_of_rain=daily_data["daily_chance_of_rain"],
-        daily_will_it_snow=daily_data["daily_will_it_snow"],
-        daily_chance_of_snow=daily_data["daily_chance_of_snow"],
-        uv=daily_data["uv"],
-        condition=daily_condition,
-        forecast_id=forecast.id,
+
+
+def save_orm_from_json(data, language=constants.DEFAULT_LANGUAGE):
+    return save_many_from_json([data], language)
+
+
+def save_many_from_json(responses, language=constants.DEFAULT_LANGUAGE):
+    # Saves any number of decoded responses in a single transaction
+    location_ids = locations.resolve_many(
+        [schema.LOCATION.row(data.location) for data in responses]
     )
-    try:
-        save_to_db(daily, db)
-    except IntegrityError:
-        logger.debug(f"Daily data already exists in database, skipping")
-
-    # Create Astro instance
-    astro_data = forecast_data["astro"]
-    astro = Astro(
-        sunrise=astro_data["sunrise"],
-        sunset=astro_data["sunset"],
-        moonrise=astro_data["moonrise"],
-        moonset=astro_data["moonset"],
-        moon_phase=astro_data["moon_phase"],
-        moon_illumination=astro_data["moon_illumination"],
-        is_moon_up=astro_data["is_moon_up"],
-        is_sun_up=astro_data["is_sun_up"],
-        forecast_id=forecast.id,
+    all_conditions = {}
+    for data in responses:
+        all_conditions.update(condition_rows(data, language))
+    condition_ids = conditions.resolve(all_conditions)
+    with Session(engine) as db, db.begin():
+        return ingest_json(db, responses, location_ids, condition_ids, language)
+
+
+def ingest_json(db, responses, location_ids, condition_ids, language):
+    # Everything below runs in the caller's transaction, with one statement per table
+    # for all responses. Current weather which already exists is skipped by the
+    # database (ON CONFLICT DO NOTHING), a forecast day replaces the one stored for
+    # its date, so each date keeps its newest forecast. Locations and conditions must
+    # already be resolved to ids, see the caches in collector/cache.py. Either part
+    # of a response may be left out when it has not changed since last time
+    def condition_id(condition_data, is_day):
+        return condition_ids[(condition_data.code, is_day, language)]
+
+    current_weather = []
+    current_details = []
+    forecasts = {}
+    for data, location_id in zip(responses, location_ids):
+        if data.current:
+            row = schema.CURRENT_WEATHER.row(
+                data.current,
+                location_id=location_id,
+                condition_id=condition_id(data.current.condition, data.current.is_day),
+            )
+            current_weather.append(row)
+            current_details.append(
+                latest_details(data.location, data.current.condition)
+            )
+        for forecast_data in data.forecast.forecastday:
+            forecast_date = schema.parse_date(forecast_data.date)
+            # PostgreSQL refuses to update the same row twice in one statement, so
+            # of a day sent in several responses of the batch the last one is kept
+            forecasts[(location_id, forecast_date)] = (forecast_data, data.location)
+
+    rows_written = {}
+    rows_existing = {}
+    inserted = upsert(
+        db,
+        CurrentWeather,
+        current_weather,
+        ["last_updated", "location_id"],
+        returning=["id", "location_id", "last_updated"],
     )
-    try:
-        save_to_db(astro, db)
-    except IntegrityError:
-        logger.debug(f"Astro data already exists in database, skipping")
-
-    # Create Hourly instances
-    hourly_instances = []
-    for hour_data in forecast_data["hour"]:
-        hour_condition_data = hour_data["condition"]
-        hour_condition = Condition(
-            text=hour_condition_data["text"],
-            icon=hour_condition_data["icon"],
-            code=hour_condition_data["code"],
+    if len(inserted) < len(current_weather):
+        logger.debug(
+            f"Skipped {len(current_weather) - len(inserted)} existing current weather rows"
+        )
+    rows_written["currentweather"] = len(inserted)
+    rows_existing["currentweather"] = len(current_weather) - len(inserted)
+    current_ids = {(row.location_id, row.last_updated): row.id for row in inserted}
+    changed_locations = update_latest(
+        db,
+        LatestCurrent,
+        [
+            row | details | {"currentweather_id": current_id}
+            for row, details in zip(current_weather, current_details)
+            if (
+                current_id := current_ids.get((row["location_id"], row["last_updated"]))
+            )
+        ],
+        "last_updated",
+    )
+
+    # A no-op update makes ids of existing forecasts come back as well
+    forecast_ids = {
+        (forecast.location_id, forecast.date): forecast.id
+        for forecast in upsert(
+            db,
+            Forecast,
+            [
+                dict(date=forecast_date, location_id=location_id)
+                for location_id, forecast_date in forecasts
+            ],
+            ["date", "location_id"],
+            update_columns=["date"],
+            returning=["id", "location_id", "date"],
         )
-        hourly = Hourly(
-            time=datetime.strptime(hour_data["time"], "%Y-%m-%d %H:%M"),
-            temp_c=hour_data["temp_c"],
-            temp_f=hour_data["temp_f"],
-            is_day=hour_data["is_day"],
-            wind_mph=hour_data["wind_mph"],
-            wind_kph=hour_data["wind_kph"],
-            wind_degree=hour_data["wind_degree"],
-            wind_dir=hour_data["wind_dir"],
-            pressure_mb=hour_data["pressure_mb"],
-            pressure_in=hour_data["pressure_in"],
-            precip_mm=hour_data["precip_mm"],
-            precip_in=hour_data["precip_in"],
-            snow_cm=hour_data["snow_cm"],
-            humidity=hour_data["humidity"],
-            cloud=hour_data["cloud"],
-            feelslike_c=hour_data["feelslike_c"],
-            feelslike_f=hour_data["feelslike_f"],
-            windchill_c=hour_data["windchill_c"],
-            windchill_f=hour_data["windchill_f"],
-            heatindex_c=hour_data["heatindex_c"],
-            heatindex_f=hour_data["heatindex_f"],
-            dewpoint_c=hour_data["dewpoint_c"],
-            dewpoint_f=hour_data["dewpoint_f"],
-            will_it_rain=hour_data["will_it_rain"],
-            chance_of_rain=hour_data["chance_of_rain"],
-            will_it_snow=hour_data["will_it_snow"],
-            chance_of_snow=hour_data["chance_of_snow"],
-            vis_km=hour_data["vis_km"],
-            vis_miles=hour_data["vis_miles"],
-            gust_mph=hour_data["gust_mph"],
-            gust_kph=hour_data["gust_kph"],
-            uv=hour_data["uv"],
-            condition=hour_condition,
-            forecast_id=forecast.id,
+    }
+
+    daily = []
+    daily_details = []
+    astro = []
+    hourly = []
+    for (location_id, forecast_date), (
+        forecast_data,
+        location_data,
+    ) in forecasts.items():
+        forecast_id = forecast_ids[(location_id, forecast_date)]
+        daily.append(
+            schema.DAILY.row(
+                forecast_data.day,
+                forecast_id=forecast_id,
+                condition_id=condition_id(forecast_data.day.condition, 1),
+            )
         )
-        hourly_instances.append(hourly)
-        try:
-            logger.debug(f"Adding hourly data to database")
-            db.add(hourly)
-            db.commit()
-        except SQLAlchemyError as e:
-            logger.debug(f"Failed to save data to database: {e}")
-            db.rollback()
-            print(f"Failed to save data to database: {e}")
-
-    # Add relationships
-    forecast.daily = daily
-    forecast.astro = astro
-    forecast.hourly = hourly_instances
-
-    db.close()
-    return forecast
+        daily_details.append(
+            latest_details(location_data, forecast_data.day.condition)
+            | {"location_id": location_id, "date": forecast_date}
+        )
+        astro.append(schema.ASTRO.row(forecast_data.astro, forecast_id=forecast_id))
+        for hour_data in forecast_data.hour:
+            hourly.append(
+                schema.HOURLY.row(
+                    hour_data,
+                    forecast_id=forecast_id,
+                    condition_id=condition_id(hour_data.condition, hour_data.is_day),
+                )
+            )
+
+    inserted = upsert(
+        db,
+        Daily,
+        daily,
+        ["forecast_id"],
+        update_columns=replaced_columns(Daily, ["forecast_id"]),
+        returning=["id", "forecast_id"],
+    )
+    rows_written["daily"] = len(inserted)
+    rows_existing["daily"] = len(daily) - len(inserted)
+    daily_ids = {row.forecast_id: row.id for row in inserted}
+    changed_locations |= update_latest_forecast(
+        db,
+        [
+            row | details | {"daily_id": daily_ids[row["forecast_id"]]}
+            for row, details in zip(daily, daily_details)
+        ],
+    )
+
+    inserted = upsert(
+        db,
+        Astro,
+        astro,
+        ["forecast_id"],
+        update_columns=replaced_columns(Astro, ["forecast_id"]),
+        returning=["id"],
+    )
+    rows_written["astro"] = len(inserted)
+    rows_existing["astro"] = len(astro) - len(inserted)
+
+    inserted = upsert(
+        db,
+        Hourly,
+        hourly,
+        ["forecast_id", "time"],
+        update_columns=replaced_columns(Hourly, ["forecast_id", "time"]),
+        returning=["id"],
+    )
+    logger.debug(f"Saved {len(inserted)} out of {len(hourly)} hourly rows")
+    rows_written["hourly"] = len(inserted)
+    rows_existing["hourly"] = len(hourly) - len(inserted)
+
+    bump_versions(db, changed_locations)
+    return rows_written, rows_existing
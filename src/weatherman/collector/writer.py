@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+
+from src.weatherman.collector import metrics
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+STOP = object()
+
+
+class IngestWriter:
+    # Fetch jobs put changed responses on a bounded queue and a single writer task
+    # saves them, many locations per transaction. Only one writer ever holds the
+    # database lock, and a full queue makes fetch jobs wait instead of piling up
+    def __init__(self, save, on_commit, max_queue, batch_size, flush_seconds):
+        self.save = save
+        self.on_commit = on_commit
+        self.queue = asyncio.Queue(maxsize=max_queue)
+        self.batch_size = batch_size
+        self.flush_seconds = flush_seconds
+        self.task = None
+        metrics.WRITE_QUEUE_DEPTH.set_function(self.queue.qsize)
+
+    def start(self):
+        self.task = asyncio.create_task(self.run())
+
+    async def put(self, changes):
+        await self.queue.put(changes)
+
+    async def close(self):
+        # Everything queued before close() is written before it returns
+        if self.task is None:
+            return
+        if not self.task.done():
+            await self.queue.put(STOP)
+        await self.task
+        self.task = None
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await self.queue.get()
+            if item is STOP:
+                break
+            batch = [item]
+            # Flush when the batch is full or flush_seconds after its first item
+            deadline = loop.time() + self.flush_seconds
+            while len(batch) < self.batch_size:
+                try:
+                    item = await asyncio.wait_for(
+                        self.queue.get(), max(deadline - loop.time(), 0)
+                    )
+                except asyncio.TimeoutError:
+                    break
+                if item is STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self.flush(batch)
+        logger.debug("Ingest writer stopped")
+
+    async def flush(self, batch):
+        logger.debug(f"Writing {len(batch)} responses, {self.queue.qsize()} queued")
+        started = time.perf_counter()
+        try:
+            rows_written, rows_existing = await asyncio.to_thread(
+                self.save, [changes.data for changes in batch]
+            )
+        except Exception as e:
+            # Whatever the error, the batch is given up and the writer goes on
+            if len(batch) == 1:
+                logger.error(f"Failed to save weather to database: {e}")
+                metrics.WRITE_FAILURES.inc()
+                return
+            # Retry one by one, so a single bad response does not lose the others
+            logger.warning(f"Failed to save batch, saving responses one by one: {e}")
+            for changes in batch:
+                await self.flush([changes])
+            return
+        metrics.WRITE_SECONDS.observe(time.perf_counter() - started)
+        for table, rows in rows_written.items():
+            metrics.ROWS_WRITTEN.labels(table).inc(rows)
+        for table, rows in rows_existing.items():
+            metrics.ROWS_EXISTING.labels(table).inc(rows)
+        for changes in batch:
+            self.on_commit(changes)
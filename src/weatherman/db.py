@@ -1,25 +1,50 @@
 from os import getenv, getcwd
 
-from sqlalchemy.exc import IntegrityError
-from sqlmodel import create_engine
+from sqlalchemy.dialects import postgresql, sqlite
 import logging
 
+from src.weatherman.storage import make_engine
+
 logger = logging.getLogger(__name__)
 logger.addHandler(logging.StreamHandler())
 db_url = getenv("DATABASE_URL")
 logger.debug(f"Current workdir is {getcwd()}")
 logger.debug(f"Connecting to database at {db_url}")
-engine = create_engine(db_url)
+engine = make_engine(db_url)
+
+
+def dialect_insert(db, model):
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        return sqlite.insert(model)
+    if dialect == "postgresql":
+        return postgresql.insert(model)
+    raise ValueError(f"Upserts are not supported for {dialect} databases")
 
 
-def save_to_db(data, db):
-    try:
-        db.add(data)
-        db.commit()
-        logger.debug(f"Data added to database")
-    except IntegrityError as e:
-        logging.debug(
-            f"Failed to save data to database, row violates data integrity: {e}"
+def upsert(
+    db, model, rows, conflict_columns, update_columns=None, returning=None, where=None
+):
+    # Conflicting rows are skipped, or have update_columns overwritten if given. Only
+    # inserted or updated rows are returned, so a no-op update on one of the conflict
+    # columns is the way to get ids of rows that already exist. A where clause, or a
+    # function building one from the excluded (new) row, limits which existing rows
+    # may be overwritten
+    if not rows:
+        return []
+    stmt = dialect_insert(db, model)
+    if callable(where):
+        where = where(stmt.excluded)
+    if update_columns:
+        stmt = stmt.on_conflict_do_update(
+            index_elements=conflict_columns,
+            set_={column: stmt.excluded[column] for column in update_columns},
+            where=where,
         )
-        db.rollback()
-        raise e
+    else:
+        stmt = stmt.on_conflict_do_nothing(index_elements=conflict_columns)
+    if returning:
+        stmt = stmt.returning(*(getattr(model, column) for column in returning))
+        return db.execute(stmt, rows).all()
+    db.execute(stmt, rows)
+    return []
@@ -0,0 +1,291 @@
+import argparse
+from datetime import datetime
+from os import getenv
+import logging
+import sys
+import time
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from sqlalchemy import DateTime, Float, Integer, Select, String
+
+from src.weatherman.ormodels import (
+    Condition,
+    CurrentWeather,
+    Daily,
+    Forecast,
+    Hourly,
+    Location,
+)
+from src.weatherman.storage import make_engine
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+# Rows per record batch, and per Parquet row group
+EXPORT_BATCH_SIZE = 16384
+FORMATS = {
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+ARROW_TYPES = [
+    (DateTime, pa.timestamp("us")),
+    (Integer, pa.int64()),
+    (Float, pa.float64()),
+    (String, pa.string()),
+]
+
+
+def location_columns():
+    return [
+        Location.name.label("location_name"),
+        Location.region.label("location_region"),
+        Location.country.label("location_country"),
+        Location.lat,
+        Location.lon,
+        Location.tz_id,
+    ]
+
+
+def condition_columns():
+    return [
+        Condition.code.label("condition_code"),
+        Condition.text.label("condition_text"),
+    ]
+
+
+def model_columns(model, *excluded):
+    return [
+        column
+        for name, column in model.__table__.columns.items()
+        if name not in ("id", "condition_id", *excluded)
+    ]
+
+
+def current_weather_query():
+    return (
+        Select(
+            *model_columns(CurrentWeather),
+            *location_columns(),
+            *condition_columns(),
+        )
+        .join(Location, CurrentWeather.location_id == Location.id)
+        .join(Condition, CurrentWeather.condition_id == Condition.id, isouter=True)
+    )
+
+
+def hourly_query():
+    return (
+        Select(
+            Forecast.location_id,
+            *model_columns(Hourly, "forecast_id"),
+            *location_columns(),
+            *condition_columns(),
+        )
+        .join(Forecast, Hourly.forecast_id == Forecast.id)
+        .join(Location, Forecast.location_id == Location.id)
+        .join(Condition, Hourly.condition_id == Condition.id, isouter=True)
+    )
+
+
+def daily_query():
+    return (
+        Select(
+            Forecast.location_id,
+            Forecast.date,
+            *model_columns(Daily, "forecast_id"),
+            *location_columns(),
+            *condition_columns(),
+        )
+        .join(Forecast, Daily.forecast_id == Forecast.id)
+        .join(Location, Forecast.location_id == Location.id)
+        .join(Condition, Daily.condition_id == Condition.id, isouter=True)
+    )
+
+
+# Exported table name -> query joined with location and condition, the location
+# and time columns it is filtered on, and the columns it is ordered on. Hours are
+# ordered by forecast date first, which is the same order, so that the database
+# can read them through its indexes instead of sorting them
+TABLES = {
+    "current": (
+        current_weather_query,
+        CurrentWeather.location_id,
+        CurrentWeather.last_updated,
+        (CurrentWeather.location_id, CurrentWeather.last_updated),
+    ),
+    "hourly": (
+        hourly_query,
+        Forecast.location_id,
+        Hourly.time,
+        (Forecast.location_id, Forecast.date, Forecast.id, Hourly.time),
+    ),
+    "daily": (
+        daily_query,
+        Forecast.location_id,
+        Forecast.date,
+        (Forecast.location_id, Forecast.date),
+    ),
+}
+
+
+def export_query(table, location_ids=None, start=None, end=None):
+    # Rows come out per location and in time order
+    build, location_column, time_column, order = TABLES[table]
+    query = build()
+    if location_ids:
+        query = query.where(location_column.in_(location_ids))
+    if start is not None:
+        query = query.where(time_column >= start)
+    if end is not None:
+        query = query.where(time_column < end)
+    return query.order_by(*order)
+
+
+def arrow_type(column):
+    # SQLModel's string columns wrap String in a TypeDecorator
+    sql_type = getattr(column.type, "impl_instance", column.type)
+    for column_type, arrow in ARROW_TYPES:
+        if isinstance(sql_type, column_type):
+            return arrow
+    raise ValueError(f"No Arrow type for column {column.name}: {column.type}")
+
+
+def arrow_schema(query):
+    return pa.schema(
+        [pa.field(column.name, arrow_type(column)) for column in query.selected_columns]
+    )
+
+
+def record_batches(connection, query, schema, batch_size):
+    # The result is fetched batch_size rows at a time, through a server side cursor
+    # where the database has one, so only one batch is held in memory
+    result = connection.execution_options(
+        stream_results=True, yield_per=batch_size
+    ).execute(query)
+    for rows in result.partitions():
+        columns = zip(*rows)
+        yield pa.RecordBatch.from_arrays(
+            [pa.array(values, type) for values, type in zip(columns, schema.types)],
+            schema=schema,
+        )
+
+
+def open_writer(sink, schema, file_format):
+    if file_format == "parquet":
+        return pq.ParquetWriter(sink, schema, compression="zstd")
+    return pa.ipc.new_stream(sink, schema)
+
+
+def export(
+    connection,
+    table,
+    sink,
+    file_format,
+    location_ids=None,
+    start=None,
+    end=None,
+    batch_size=EXPORT_BATCH_SIZE,
+):
+    # Writes the rows to sink one record batch at a time and yields the number of
+    # rows after each batch, so a caller can pass on what was written so far
+    query = export_query(table, location_ids, start, end)
+    schema = arrow_schema(query)
+    with open_writer(sink, schema, file_format) as writer:
+        for batch in record_batches(connection, query, schema, batch_size):
+            writer.write_batch(batch)
+            yield batch.num_rows
+
+
+class ChunkSink:
+    # Write-only file object that hands out what was written since the last take()
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream(
+    engine,
+    table,
+    file_format,
+    location_ids=None,
+    start=None,
+    end=None,
+    batch_size=EXPORT_BATCH_SIZE,
+):
+    # Export as an iterator of bytes, for streaming responses
+    sink = ChunkSink()
+    with engine.connect() as connection:
+        rows = export(
+            connection, table, sink, file_format, location_ids, start, end, batch_size
+        )
+        for _ in rows:
+            yield sink.take()
+    yield sink.take()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Export weather history to Parquet or Arrow IPC"
+    )
+    parser.add_argument("table", choices=TABLES)
+    parser.add_argument("output", help="File to write")
+    parser.add_argument("--format", choices=FORMATS, default="parquet")
+    parser.add_argument(
+        "--location", type=int, action="append", help="Location id, can be repeated"
+    )
+    parser.add_argument("--start", type=datetime.fromisoformat, help="From (inclusive)")
+    parser.add_argument("--end", type=datetime.fromisoformat, help="Until (exclusive)")
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=int(getenv("EXPORT_BATCH_SIZE", EXPORT_BATCH_SIZE)),
+        help="Rows per record batch",
+    )
+    args = parser.parse_args()
+
+    db_url = getenv("DATABASE_URL")
+    if db_url is None:
+        logger.error("DATABASE_URL environment variable not set")
+        sys.exit(1)
+    started = time.perf_counter()
+    with make_engine(db_url).connect() as connection:
+        rows = sum(
+            export(
+                connection,
+                args.table,
+                args.output,
+                args.format,
+                args.location,
+                args.start,
+                args.end,
+                max(args.batch_size, 1),
+            )
+        )
+    elapsed = time.perf_counter() - started
+    logger.info(f"Exported {rows} {args.table} rows to {args.output} in {elapsed:.1f}s")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[])
+    main()
@@ -0,0 +1,491 @@
+from datetime import datetime, timedelta, timezone
+from os import getenv
+import logging
+
+from sqlalchemy import delete, func, insert, inspect, literal, select, text
+from sqlalchemy.schema import AddConstraint, CreateIndex
+from sqlmodel import SQLModel
+
+from src.weatherman.collector.constants import DEFAULT_LANGUAGE
+import src.weatherman.ormodels as ormodels
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+# Schema changes are applied in list order, each in its own transaction, and
+# recorded by number in the schemaversion table. Never edit a released migration,
+# add a new one instead. Migrations must work on a database created by any earlier
+# version of weatherman, and on one where create_all already created the latest
+# models. A migration for tables from before versioned migrations goes right after
+# the first one, with the next free number
+
+
+def create_tables(connection):
+    # Creates whatever tables, constraints and indexes are missing. Existing tables
+    # are left as they are
+    SQLModel.metadata.create_all(connection)
+
+
+def table_columns(connection, table):
+    return {column["name"] for column in inspect(connection).get_columns(table)}
+
+
+def rename_table(connection, table, old):
+    # Moves a table out of the way of its replacement. PostgreSQL keeps the names of
+    # its sequence and indexes, so those are renamed as well
+    connection.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+    if connection.dialect.name != "postgresql":
+        return
+    connection.execute(
+        text(f"ALTER SEQUENCE IF EXISTS {table}_id_seq RENAME TO {old}_id_seq")
+    )
+    for name in inspect(connection).get_indexes(old) + [
+        inspect(connection).get_pk_constraint(old)
+    ]:
+        connection.execute(
+            text(f"ALTER INDEX {name['name']} RENAME TO {name['name']}_old")
+        )
+
+
+# Tables whose rows each had a condition row of their own, by the column of the old
+# condition table pointing at them and how is_day is found
+CONDITION_OWNERS = {
+    "currentweather": ("current_weather_id", "currentweather.is_day"),
+    "daily": ("daily_id", "1"),
+    "hourly": ("hourly_id", "hourly.is_day"),
+}
+
+
+def intern_conditions(connection):
+    # Conditions used to be stored once per current weather, daily and hourly row.
+    # They are merged into one row per code, day or night and language, the
+    # language being the collector's default, and referenced by condition_id
+    if "current_weather_id" not in table_columns(connection, "condition"):
+        return
+    # The first migration created the newer tables referencing condition next to
+    # the old one, they are still empty and are created again at the end
+    for table in reversed(SQLModel.metadata.sorted_tables):
+        if (
+            table.name not in CONDITION_OWNERS
+            and any(key.column.table.name == "condition" for key in table.foreign_keys)
+            and inspect(connection).has_table(table.name)
+        ):
+            table.drop(connection)
+    rename_table(connection, "condition", "condition_old")
+    ormodels.Condition.__table__.create(connection)
+    conditions = []
+    for table, (owner, is_day) in CONDITION_OWNERS.items():
+        connection.execute(
+            text(f"CREATE INDEX ix_condition_old_{owner} ON condition_old ({owner})")
+        )
+        conditions.append(
+            f"SELECT condition_old.code, {is_day} AS is_day, condition_old.text,"
+            f" condition_old.icon FROM condition_old"
+            f" JOIN {table} ON {table}.id = condition_old.{owner}"
+        )
+    connection.execute(
+        text(
+            "INSERT INTO condition (code, is_day, language, text, icon)"
+            " SELECT code, is_day, :language, max(text), max(icon)"
+            f" FROM ({' UNION ALL '.join(conditions)}) AS conditions"
+            " GROUP BY code, is_day"
+        ),
+        {"language": DEFAULT_LANGUAGE},
+    )
+    for table, (owner, is_day) in CONDITION_OWNERS.items():
+        connection.execute(
+            text(
+                f"ALTER TABLE {table} ADD COLUMN condition_id INTEGER"
+                " REFERENCES condition (id)"
+            )
+        )
+        connection.execute(
+            text(
+                f"UPDATE {table} SET condition_id = (SELECT min(condition.id)"
+                " FROM condition_old JOIN condition"
+                " ON condition.code = condition_old.code"
+                f" AND condition.is_day = {is_day}"
+                " AND condition.language = :language"
+                f" WHERE condition_old.{owner} = {table}.id)"
+            ),
+            {"language": DEFAULT_LANGUAGE},
+        )
+    connection.execute(text("DROP TABLE condition_old"))
+    create_tables(connection)
+
+
+def scope_hourly_times(connection):
+    # Hourly times used to be unique on their own, so the same hour of a second
+    # location was dropped. They are unique per forecast now
+    constraints = inspect(connection).get_unique_constraints("hourly")
+    if "unique_time_constraint" not in {
+        constraint["name"] for constraint in constraints
+    }:
+        return
+    if connection.dialect.name == "postgresql":
+        connection.execute(
+            text("ALTER TABLE hourly DROP CONSTRAINT unique_time_constraint")
+        )
+        for constraint in ormodels.Hourly.__table__.constraints:
+            if constraint.name == "unique_forecast_time_constraint":
+                connection.execute(AddConstraint(constraint))
+        return
+    # SQLite cannot drop a constraint, the table is built again instead
+    for index in inspect(connection).get_indexes("hourly"):
+        connection.execute(text(f"DROP INDEX {index['name']}"))
+    rename_table(connection, "hourly", "hourly_old")
+    ormodels.Hourly.__table__.create(connection)
+    columns = ", ".join(ormodels.Hourly.__table__.columns.keys())
+    connection.execute(
+        text(f"INSERT INTO hourly ({columns}) SELECT {columns} FROM hourly_old")
+    )
+    connection.execute(text("DROP TABLE hourly_old"))
+
+
+def create_indexes(*names):
+    def migration(connection):
+        for table in SQLModel.metadata.sorted_tables:
+            for index in table.indexes:
+                if index.name in names:
+                    index.create(connection, checkfirst=True)
+
+    return migration
+
+
+# On PostgreSQL the observation tables are partitioned by month on these columns, so
+# queries for recent data and the retention job only touch a few small partitions
+PARTITIONED_TABLES = {"currentweather": "last_updated", "hourly": "time"}
+# Partitions are created this many months ahead of the current one
+PARTITION_MONTHS_AHEAD = 3
+
+
+def add_months(month, months):
+    index = month.year * 12 + month.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def partitions(connection, table):
+    # Monthly partitions of a table by first day of the month, without the default
+    rows = connection.execute(
+        text(
+            "SELECT child.relname FROM pg_inherits"
+            " JOIN pg_class child ON child.oid = pg_inherits.inhrelid"
+            " JOIN pg_class parent ON parent.oid = pg_inherits.inhparent"
+            " WHERE parent.relname = :table"
+        ),
+        {"table": table},
+    ).scalars()
+    return {
+        datetime.strptime(name[len(table) + 1 :], "%Y_%m"): name
+        for name in rows
+        if name != f"{table}_default"
+    }
+
+
+def create_partition(connection, table, column, month):
+    # Rows for the month that already went to the default partition are moved into
+    # the new one, otherwise attaching it would fail
+    name = f"{table}_{month:%Y_%m}"
+    start = f"{month:%Y-%m-%d}"
+    end = f"{add_months(month, 1):%Y-%m-%d}"
+    connection.execute(text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS)"))
+    connection.execute(
+        text(
+            f"WITH moved AS (DELETE FROM {table}_default"
+            f" WHERE {column} >= '{start}' AND {column} < '{end}' RETURNING *)"
+            f" INSERT INTO {name} SELECT * FROM moved"
+        )
+    )
+    connection.execute(
+        text(
+            f"ALTER TABLE {table} ATTACH PARTITION {name}"
+            f" FOR VALUES FROM ('{start}') TO ('{end}')"
+        )
+    )
+    logger.info(f"Created partition {name}")
+
+
+def create_monthly_partitions(connection, table, column, first_month=None):
+    # Creates the missing partitions from first_month, or the current month, up to
+    # PARTITION_MONTHS_AHEAD months from now
+    months_ahead = int(getenv("PARTITION_MONTHS_AHEAD", PARTITION_MONTHS_AHEAD))
+    now = datetime.now(timezone.utc)
+    last_month = add_months(datetime(now.year, now.month, 1), months_ahead)
+    month = first_month or datetime(now.year, now.month, 1)
+    existing = partitions(connection, table)
+    while month <= last_month:
+        if month not in existing:
+            create_partition(connection, table, column, month)
+        month = add_months(month, 1)
+
+
+def create_partitions(connection):
+    # Keeps partitions ready for the coming months. Does nothing on other databases
+    if connection.dialect.name != "postgresql":
+        return
+    for table, column in PARTITIONED_TABLES.items():
+        create_monthly_partitions(connection, table, column)
+
+
+def partition_tables(connection):
+    # Rebuilds the observation tables as partitioned tables with the same columns,
+    # constraints and indexes, then copies the existing rows over. The primary key
+    # has to include the partition column, and rows outside the monthly partitions
+    # go to a default partition
+    if connection.dialect.name != "postgresql":
+        return
+    for table, column in PARTITIONED_TABLES.items():
+        old = f"{table}_unpartitioned"
+        metadata_table = SQLModel.metadata.tables[table]
+        connection.execute(text(f"ALTER TABLE {table} RENAME TO {old}"))
+        for foreign_key in inspect(connection).get_foreign_keys(old):
+            connection.execute(
+                text(f"ALTER TABLE {old} DROP CONSTRAINT {foreign_key['name']}")
+            )
+        for name in inspect(connection).get_indexes(old) + [
+            inspect(connection).get_pk_constraint(old)
+        ]:
+            connection.execute(
+                text(f"ALTER INDEX {name['name']} RENAME TO {name['name']}_old")
+            )
+        connection.execute(
+            text(
+                f"CREATE TABLE {table} (LIKE {old} INCLUDING DEFAULTS)"
+                f" PARTITION BY RANGE ({column})"
+            )
+        )
+        connection.execute(text(f"ALTER SEQUENCE {table}_id_seq OWNED BY {table}.id"))
+        connection.execute(
+            text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {table}_pkey"
+                f" PRIMARY KEY (id, {column})"
+            )
+        )
+        for constraint in metadata_table.constraints:
+            if constraint is not metadata_table.primary_key:
+                connection.execute(AddConstraint(constraint))
+        for index in metadata_table.indexes:
+            connection.execute(CreateIndex(index))
+        connection.execute(
+            text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT")
+        )
+        oldest = connection.execute(text(f"SELECT min({column}) FROM {old}")).scalar()
+        create_monthly_partitions(
+            connection,
+            table,
+            column,
+            datetime(oldest.year, oldest.month, 1) if oldest else None,
+        )
+        connection.execute(text(f"INSERT INTO {table} SELECT * FROM {old}"))
+        connection.execute(text(f"DROP TABLE {old}"))
+
+
+def copied_columns(model, prefix, source):
+    # Columns of a latest state table copied from source, e.g. location_name
+    return {
+        name: getattr(source, name[len(prefix) :])
+        for name in model.__table__.columns.keys()
+        if name.startswith(prefix) and name != f"{prefix}id"
+    }
+
+
+def fill_latest_state(connection):
+    # The collector keeps these tables up to date from now on, start them off with
+    # the newest rows already in the database
+    create_tables(connection)
+    current = ormodels.CurrentWeather
+    newest = (
+        select(current.location_id, func.max(current.last_updated).label("newest"))
+        .group_by(current.location_id)
+        .subquery()
+    )
+    columns = {
+        name: column
+        for name, column in current.__table__.columns.items()
+        if name in ormodels.LatestCurrent.__table__.columns
+    }
+    columns["currentweather_id"] = current.id
+    columns |= copied_columns(ormodels.LatestCurrent, "location_", ormodels.Location)
+    columns |= copied_columns(ormodels.LatestCurrent, "condition_", ormodels.Condition)
+    query = (
+        select(*columns.values())
+        .select_from(current)
+        .join(
+            newest,
+            (newest.c.location_id == current.location_id)
+            & (newest.c.newest == current.last_updated),
+        )
+        .join(ormodels.Location, ormodels.Location.id == current.location_id)
+        .join(ormodels.Condition, ormodels.Condition.id == current.condition_id)
+    )
+    connection.execute(delete(ormodels.LatestCurrent))
+    connection.execute(insert(ormodels.LatestCurrent).from_select(list(columns), query))
+
+    forecast = ormodels.Forecast
+    daily = ormodels.Daily
+    newest = (
+        select(forecast.location_id, func.max(forecast.date).label("newest"))
+        .join(daily, daily.forecast_id == forecast.id)
+        .group_by(forecast.location_id)
+        .subquery()
+    )
+    columns = {
+        name: column
+        for name, column in daily.__table__.columns.items()
+        if name in ormodels.LatestForecast.__table__.columns
+    }
+    columns |= {
+        "daily_id": daily.id,
+        "location_id": forecast.location_id,
+        "date": forecast.date,
+    }
+    columns |= copied_columns(ormodels.LatestForecast, "location_", ormodels.Location)
+    columns |= copied_columns(ormodels.LatestForecast, "condition_", ormodels.Condition)
+    query = (
+        select(*columns.values())
+        .select_from(forecast)
+        .join(
+            newest,
+            (newest.c.location_id == forecast.location_id)
+            & (newest.c.newest == forecast.date),
+        )
+        .join(daily, daily.forecast_id == forecast.id)
+        .join(ormodels.Location, ormodels.Location.id == forecast.location_id)
+        .join(ormodels.Condition, ormodels.Condition.id == daily.condition_id)
+    )
+    connection.execute(delete(ormodels.LatestForecast))
+    connection.execute(
+        insert(ormodels.LatestForecast).from_select(list(columns), query)
+    )
+
+
+def fill_location_versions(connection):
+    create_tables(connection)
+    connection.execute(delete(ormodels.LocationVersion))
+    connection.execute(
+        insert(ormodels.LocationVersion).from_select(
+            ["location_id", "version"], select(ormodels.Location.id, literal(1))
+        )
+    )
+
+
+def fill_latest_forecasts(connection):
+    # The latest forecast used to be kept for the furthest date only, now for every
+    # date from yesterday (UTC) on
+    ormodels.LatestForecast.__table__.drop(connection, checkfirst=True)
+    create_tables(connection)
+    forecast = ormodels.Forecast
+    daily = ormodels.Daily
+    columns = {
+        name: column
+        for name, column in daily.__table__.columns.items()
+        if name in ormodels.LatestForecast.__table__.columns
+    }
+    columns |= {
+        "daily_id": daily.id,
+        "location_id": forecast.location_id,
+        "date": forecast.date,
+    }
+    columns |= copied_columns(ormodels.LatestForecast, "location_", ormodels.Location)
+    columns |= copied_columns(ormodels.LatestForecast, "condition_", ormodels.Condition)
+    now = datetime.now(timezone.utc)
+    query = (
+        select(*columns.values())
+        .select_from(forecast)
+        .join(daily, daily.forecast_id == forecast.id)
+        .join(ormodels.Location, ormodels.Location.id == forecast.location_id)
+        .join(ormodels.Condition, ormodels.Condition.id == daily.condition_id)
+        .where(
+            forecast.date >= datetime(now.year, now.month, now.day) - timedelta(days=1)
+        )
+    )
+    connection.execute(
+        insert(ormodels.LatestForecast).from_select(list(columns), query)
+    )
+
+
+def pad_rollup_periods(connection):
+    # SQLite rollups were written without the microseconds SQLAlchemy stores every
+    # other datetime with, so the same period did not compare or conflict as equal.
+    # Where a period was rolled up twice the first one is kept, later ones may have
+    # been built from partly deleted observations
+    if connection.dialect.name != "sqlite":
+        return
+    for model in (ormodels.HourlyRollup, ormodels.DailyRollup):
+        table = model.__table__.name
+        connection.execute(
+            text(
+                f"DELETE FROM {table} WHERE length(period_start) = 26 AND EXISTS "
+                f"(SELECT 1 FROM {table} AS unpadded "
+                f"WHERE unpadded.location_id = {table}.location_id "
+                f"AND unpadded.period_start || '.000000' = {table}.period_start)"
+            )
+        )
+        connection.execute(
+            text(
+                f"UPDATE {table} SET period_start = period_start || '.000000' "
+                "WHERE length(period_start) = 19"
+            )
+        )
+
+
+MIGRATIONS = [
+    (1, "Create tables", create_tables),
+    (7, "Store conditions once per code in databases from before", intern_conditions),
+    (8, "Make hourly times unique per forecast", scope_hourly_times),
+    (
+        2,
+        "Index latest current weather and forecast lookups",
+        create_indexes(
+            "ix_currentweather_location_last_updated", "ix_forecast_location_date"
+        ),
+    ),
+    (3, "Create hourly and daily weather rollups", create_tables),
+    (4, "Partition current weather and hourly forecasts by month", partition_tables),
+    (5, "Keep the latest weather and forecast of each location", fill_latest_state),
+    (6, "Version the latest weather of each location", fill_location_versions),
+    (9, "Keep the latest forecast of every date", fill_latest_forecasts),
+    (10, "Store SQLite rollup periods with microseconds", pad_rollup_periods),
+]
+
+
+def applied_versions(connection):
+    if not inspect(connection).has_table(ormodels.SchemaVersion.__tablename__):
+        return set()
+    return set(connection.execute(select(ormodels.SchemaVersion.version)).scalars())
+
+
+def lock(connection):
+    # Several collectors may start at once. On PostgreSQL they take turns, and see
+    # the migrations applied by the others. SQLite already allows only one writer
+    if connection.dialect.name == "postgresql":
+        connection.execute(text("SELECT pg_advisory_xact_lock(4242)"))
+
+
+def migrate(engine):
+    with engine.begin() as connection:
+        lock(connection)
+        ormodels.SchemaVersion.__table__.create(connection, checkfirst=True)
+    for number, description, migration in MIGRATIONS:
+        with engine.begin() as connection:
+            lock(connection)
+            if number in applied_versions(connection):
+                continue
+            logger.info(
+                f"Migrating weather database to version {number}: {description}"
+            )
+            migration(connection)
+            connection.execute(
+                ormodels.SchemaVersion.__table__.insert().values(
+                    version=number,
+                    description=description,
+                    applied_at=datetime.now(timezone.utc).replace(tzinfo=None),
+                )
+            )
+    ensure_partitions(engine)
+
+
+def ensure_partitions(engine):
+    with engine.begin() as connection:
+        lock(connection)
+        create_partitions(connection)
@@ -1,4 +1,4 @@
-from sqlalchemy import UniqueConstraint
+from sqlalchemy import Index, UniqueConstraint
 from sqlmodel import SQLModel, Field, Relationship
 from typing import Optional, List
 from datetime import datetime
@@ -23,11 +23,27 @@ class Location(SQLModel, table=True):
     forecast: List["Forecast"] = Relationship(back_populates="location")
 
 
+class Condition(SQLModel, table=True):
+    __table_args__ = (
+        UniqueConstraint(
+            "code", "is_day", "language", name="unique_condition_constraint"
+        ),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    code: int
+    is_day: int
+    language: str
+    text: str
+    icon: str
+
+
 class CurrentWeather(SQLModel, table=True):
     __table_args__ = (
         UniqueConstraint(
             "last_updated", "location_id", name="unique_time_location_constraint"
         ),
+        # Latest current weather of a location
+        Index("ix_currentweather_location_last_updated", "location_id", "last_updated"),
     )
 
     id: Optional[int] = Field(default=None, primary_key=True)
@@ -55,33 +71,15 @@ class CurrentWeather(SQLModel, table=True):
 
     location_id: Optional[int] = Field(default=None, foreign_key="location.id")
     location: Optional[Location] = Relationship(back_populates="current_weather")
-    condition: "Condition" = Relationship(back_populates="current_weather")
-
-
-class Condition(SQLModel, table=True):
-    __table_args__ = (
-        UniqueConstraint(
-            "current_weather_id", name="unique_current_weather_observation_constraint"
-        ),
-    )
-    id: Optional[int] = Field(default=None, primary_key=True)
-    text: str
-    icon: str
-    code: int
-
-    current_weather_id: Optional[int] = Field(
-        default=None, foreign_key="currentweather.id"
-    )
-    current_weather: Optional[CurrentWeather] = Relationship(back_populates="condition")
-    daily_id: Optional[int] = Field(default=None, foreign_key="daily.id")
-    daily: Optional["Daily"] = Relationship(back_populates="condition")
-    hourly_id: Optional[int] = Field(default=None, foreign_key="hourly.id")
-    hourly: Optional["Hourly"] = Relationship(back_populates="condition")
+    condition_id: Optional[int] = Field(default=None, foreign_key="condition.id")
+    condition: Optional[Condition] = Relationship()
 
 
 class Forecast(SQLModel, table=True):
     __table_args__ = (
         UniqueConstraint("date", "location_id", name="unique_date_location_constraint"),
+        # Latest forecast of a location
+        Index("ix_forecast_location_date", "location_id", "date"),
     )
     id: Optional[int] = Field(default=None, primary_key=True)
     date: datetime
@@ -120,7 +118,8 @@ class Daily(SQLModel, table=True):
 
     forecast_id: Optional[int] = Field(default=None, foreign_key="forecast.id")
     forecast: Optional[Forecast] = Relationship(back_populates="daily")
-    condition: Condition = Relationship(back_populates="daily")
+    condition_id: Optional[int] = Field(default=None, foreign_key="condition.id")
+    condition: Optional[Condition] = Relationship()
 
 
 class Astro(SQLModel, table=True):
@@ -142,7 +141,9 @@ class Astro(SQLModel, table=True):
 
 
 class Hourly(SQLModel, table=True):
-    __table_args__ = (UniqueConstraint("time", name="unique_time_constraint"),)
+    __table_args__ = (
+        UniqueConstraint("forecast_id", "time", name="unique_forecast_time_constraint"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     time: datetime
     temp_c: float
@@ -179,4 +180,158 @@ class Hourly(SQLModel, table=True):
 
     forecast_id: Optional[int] = Field(default=None, foreign_key="forecast.id")
     forecast: Optional[Forecast] = Relationship(back_populates="hourly")
-    condition: Condition = Relationship(back_populates="hourly")
+    condition_id: Optional[int] = Field(default=None, foreign_key="condition.id")
+    condition: Optional[Condition] = Relationship()
+
+
+class CollectorMember(SQLModel, table=True):
+    # Running collector instances, a member is gone once its heartbeat is too old
+    id: str = Field(primary_key=True)
+    heartbeat: datetime
+
+
+class LocationLease(SQLModel, table=True):
+    # Which collector instance fetches a location, until the lease expires
+    location: str = Field(primary_key=True)
+    owner: str = Field(index=True)
+    expires: datetime
+
+
+class SchemaVersion(SQLModel, table=True):
+    # Migrations applied to this database, see migrations.py
+    version: int = Field(primary_key=True)
+    description: str
+    applied_at: datetime
+
+
+class WeatherRollup(SQLModel):
+    # Minimum, maximum and average of current weather over a period, kept after the
+    # raw observations are deleted by the retention job
+    id: Optional[int] = Field(default=None, primary_key=True)
+    period_start: datetime
+    samples: int
+    temp_c_min: float
+    temp_c_max: float
+    temp_c_avg: float
+    feelslike_c_min: float
+    feelslike_c_max: float
+    feelslike_c_avg: float
+    humidity_min: float
+    humidity_max: float
+    humidity_avg: float
+    pressure_mb_min: float
+    pressure_mb_max: float
+    pressure_mb_avg: float
+    wind_kph_min: float
+    wind_kph_max: float
+    wind_kph_avg: float
+    gust_kph_min: float
+    gust_kph_max: float
+    gust_kph_avg: float
+    precip_mm_min: float
+    precip_mm_max: float
+    precip_mm_avg: float
+    cloud_min: float
+    cloud_max: float
+    cloud_avg: float
+    uv_min: float
+    uv_max: float
+    uv_avg: float
+
+    location_id: Optional[int] = Field(default=None, foreign_key="location.id")
+
+
+class HourlyRollup(WeatherRollup, table=True):
+    __table_args__ = (
+        UniqueConstraint(
+            "location_id", "period_start", name="unique_hourly_rollup_constraint"
+        ),
+    )
+
+
+class DailyRollup(WeatherRollup, table=True):
+    __table_args__ = (
+        UniqueConstraint(
+            "location_id", "period_start", name="unique_daily_rollup_constraint"
+        ),
+    )
+
+
+class LocationVersion(SQLModel, table=True):
+    # Bumped by the collector whenever the latest weather or forecast of a location
+    # changes, so the API can tell whether a cached response is still current
+    location_id: Optional[int] = Field(
+        default=None, primary_key=True, foreign_key="location.id"
+    )
+    version: int
+
+
+class LatestState(SQLModel):
+    # One row per location, written by the collector in the same transaction as the
+    # data it comes from. Location and condition are copied in, so the API answers
+    # with a single primary key lookup
+    location_id: Optional[int] = Field(
+        default=None, primary_key=True, foreign_key="location.id"
+    )
+    location_name: str
+    location_region: str
+    location_country: str
+    location_lat: float
+    location_lon: float
+    location_tz_id: str
+    condition_id: Optional[int] = Field(default=None, foreign_key="condition.id")
+    condition_code: int
+    condition_text: str
+    condition_icon: str
+
+
+class LatestCurrent(LatestState, table=True):
+    # Newest row of currentweather for each location
+    currentweather_id: int
+    last_updated: datetime
+    temp_c: float
+    temp_f: float
+    is_day: int
+    wind_mph: float
+    wind_kph: float
+    wind_degree: int
+    wind_dir: str
+    pressure_mb: float
+    pressure_in: float
+    precip_mm: float
+    precip_in: float
+    humidity: int
+    cloud: int
+    feelslike_c: float
+    feelslike_f: float
+    vis_km: float
+    vis_miles: float
+    uv: float
+    gust_mph: float
+    gust_kph: float
+
+
+class LatestForecast(LatestState, table=True):
+    # Newest daily forecast of each location and date, from yesterday (UTC) on
+    date: datetime = Field(primary_key=True)
+    forecast_id: int
+    daily_id: int
+    maxtemp_c: float
+    maxtemp_f: float
+    mintemp_c: float
+    mintemp_f: float
+    avgtemp_c: float
+    avgtemp_f: float
+    maxwind_mph: float
+    maxwind_kph: float
+    totalprecip_mm: float
+    totalprecip_in: float
+    totalsnow_cm: float
+    avgvis_km: float
+    avgvis_miles: float
+    avghumidity: float
+    daily_will_it_rain: int
+    daily_chance_of_rain: int
+    daily_will_it_snow: int
+    daily_chance_of_snow: int
+    uv: float
@@ -0,0 +1,91 @@
+from os import getenv
+import logging
+
+from sqlalchemy import event, make_url
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlmodel import create_engine
+
+logger = logging.getLogger(__name__)
+logger.addHandler(logging.StreamHandler())
+
+# SQLite settings applied to every new connection. WAL lets the API read while the
+# collector writes, and with synchronous=NORMAL a commit only waits for the WAL, not
+# for the database file. Each can be overridden with the environment variable of
+# the same name
+SQLITE_PRAGMAS = {
+    "SQLITE_JOURNAL_MODE": ("journal_mode", "WAL"),
+    "SQLITE_SYNCHRONOUS": ("synchronous", "NORMAL"),
+    "SQLITE_BUSY_TIMEOUT_MS": ("busy_timeout", "5000"),
+    "SQLITE_CACHE_SIZE": ("cache_size", "-65536"),
+    "SQLITE_MMAP_SIZE": ("mmap_size", "268435456"),
+    "SQLITE_TEMP_STORE": ("temp_store", "MEMORY"),
+}
+DB_POOL_SIZE = 10
+DB_MAX_OVERFLOW = 20
+DB_POOL_RECYCLE_SECONDS = 1800
+# Asyncio drivers per backend, the first one is used when the URL names another.
+# SQLite has none, the API runs its statements on the event loop
+ASYNC_DRIVERS = {
+    "postgresql": ("asyncpg", "psycopg"),
+}
+
+
+def sqlite_pragmas():
+    return [
+        (pragma, getenv(variable, default))
+        for variable, (pragma, default) in SQLITE_PRAGMAS.items()
+        if getenv(variable, default)
+    ]
+
+
+def set_sqlite_pragmas(engine, url):
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma, value in pragmas:
+            cursor.execute(f"PRAGMA {pragma}={value}")
+        cursor.close()
+
+    logger.debug(f"SQLite pragmas for {url}: {pragmas}")
+
+
+def pool_options():
+    # Server databases: reuse connections, but drop ones the server may have closed
+    return dict(
+        pool_size=int(getenv("DB_POOL_SIZE", DB_POOL_SIZE)),
+        max_overflow=int(getenv("DB_MAX_OVERFLOW", DB_MAX_OVERFLOW)),
+        pool_pre_ping=True,
+        pool_recycle=int(getenv("DB_POOL_RECYCLE_SECONDS", DB_POOL_RECYCLE_SECONDS)),
+    )
+
+
+def make_engine(url):
+    # Creates an engine with the storage profile of its backend
+    if url.startswith("sqlite"):
+        # SQLite connections are cheap and there is only ever one writer, so the
+        # default pool is kept
+        engine = create_engine(url)
+        set_sqlite_pragmas(engine, url)
+        return engine
+    return create_engine(url, **pool_options())
+
+
+def async_url(url):
+    # The same database through the asyncio driver of its backend
+    url = make_url(url)
+    backend = url.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver configured for {backend} databases")
+    if url.get_driver_name() not in ASYNC_DRIVERS[backend]:
+        url = url.set(drivername=f"{backend}+{ASYNC_DRIVERS[backend][0]}")
+    return url
+
+
+def make_async_engine(url):
+    # Asyncio counterpart of make_engine, with the same storage profile. None for
+    # SQLite, see api/database.py
+    if make_url(url).get_backend_name() == "sqlite":
+        return None
+    return create_async_engine(async_url(url), **pool_options())
@@ -0,0 +1,20 @@
+import os
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+# The collector imports its constants by module name, as in its container
+sys.path.insert(0, str(Path(__file__).parents[1] / "src" / "weatherman" / "collector"))
+# The database is chosen when src.weatherman.db is imported, each run gets its own
+os.environ["DATABASE_URL"] = f"sqlite:///{tempfile.mkdtemp()}/weather.db"
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    from src.weatherman.db import engine
+    from src.weatherman.migrations import migrate
+
+    migrate(engine)
+    return engine
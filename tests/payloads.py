@@ -0,0 +1,126 @@
+import random
+from datetime import datetime, timedelta
+
+# weatherapi.com responses with the fields the collector reads, values vary with
+# the seed
+
+
+def condition(code=1000, text="Sunny"):
+    return {
+        "text": text,
+        "icon": f"//cdn.weatherapi.com/weather/64x64/day/{code - 887}.png",
+        "code": code,
+    }
+
+
+def current(time, seed=0):
+    values = random.Random(seed)
+    return {
+        "last_updated_epoch": int(time.timestamp()),
+        "last_updated": time.strftime("%Y-%m-%d %H:%M"),
+        "temp_c": values.uniform(-5, 30),
+        "temp_f": 50.0,
+        "is_day": 1,
+        "condition": condition(values.choice([1000, 1003, 1006])),
+        "wind_mph": 3.1,
+        "wind_kph": 5.0,
+        "wind_degree": 180,
+        "wind_dir": "S",
+        "pressure_mb": 1012.0,
+        "pressure_in": 29.9,
+        "precip_mm": 0.0,
+        "precip_in": 0.0,
+        "humidity": 60,
+        "cloud": 25,
+        "feelslike_c": 10.0,
+        "feelslike_f": 50.0,
+        "windchill_c": 9.0,
+        "windchill_f": 48.0,
+        "heatindex_c": 10.0,
+        "heatindex_f": 50.0,
+        "dewpoint_c": 3.0,
+        "dewpoint_f": 37.0,
+        "vis_km": 10.0,
+        "vis_miles": 6.0,
+        "uv": 3.0,
+        "gust_mph": 5.0,
+        "gust_kph": 8.0,
+    }
+
+
+def hour(time, seed=0):
+    row = current(time, seed)
+    del row["last_updated"], row["last_updated_epoch"]
+    row.update(
+        time_epoch=int(time.timestamp()),
+        time=time.strftime("%Y-%m-%d %H:%M"),
+        snow_cm=0.0,
+        will_it_rain=0,
+        chance_of_rain=10,
+        will_it_snow=0,
+        chance_of_snow=0,
+    )
+    return row
+
+
+def forecast_day(day, seed=0):
+    return {
+        "date": day.strftime("%Y-%m-%d"),
+        "date_epoch": int(day.timestamp()),
+        "day": {
+            "maxtemp_c": 20.0,
+            "maxtemp_f": 68.0,
+            "mintemp_c": 10.0,
+            "mintemp_f": 50.0,
+            "avgtemp_c": 15.0,
+            "avgtemp_f": 59.0,
+            "maxwind_mph": 10.0,
+            "maxwind_kph": 16.0,
+            "totalprecip_mm": 0.0,
+            "totalprecip_in": 0.0,
+            "totalsnow_cm": 0.0,
+            "avgvis_km": 10.0,
+            "avgvis_miles": 6.0,
+            "avghumidity": 70,
+            "daily_will_it_rain": 0,
+            "daily_chance_of_rain": 0,
+            "daily_will_it_snow": 0,
+            "daily_chance_of_snow": 0,
+            "condition": condition(1003, "Partly cloudy"),
+            "uv": 4.0,
+        },
+        "astro": {
+            "sunrise": "07:01 AM",
+            "sunset": "06:12 PM",
+            "moonrise": "01:00 AM",
+            "moonset": "03:00 PM",
+            "moon_phase": "Waning Crescent",
+            "moon_illumination": 30,
+            "is_moon_up": 0,
+            "is_sun_up": 0,
+        },
+        "hour": [hour(day + timedelta(hours=h), seed + h) for h in range(24)],
+    }
+
+
+def response(name="Prague", time=None, days=1, seed=0):
+    time = time or datetime(2026, 10, 18, 12, 15)
+    today = datetime(time.year, time.month, time.day)
+    return {
+        "location": {
+            "name": name,
+            "region": f"Region {name}",
+            "country": "Country",
+            "lat": 50.0,
+            "lon": 14.0,
+            "tz_id": "Europe/Prague",
+            "localtime_epoch": int(time.timestamp()),
+            "localtime": time.strftime("%Y-%m-%d %H:%M"),
+        },
+        "current": current(time, seed),
+        "forecast": {
+            "forecastday": [
+                forecast_day(today + timedelta(days=d), seed) for d in range(days)
+            ]
+        },
+    }
@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+import httpx
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from src.weatherman.collector.weatherapi import WeatherApi
+from src.weatherman.db import engine
+from src.weatherman.ormodels import CurrentWeather, Location
+from tests.payloads import response
+
+NOT_FOUND = {"code": 1006, "message": "No matching location found."}
+
+
+class StubApi:
+    # Stands in for weatherapi.com. Locations in `errors` are not found, `missing`
+    # ones are left out of bulk answers and `bad` ones come with a timestamp the
+    # collector cannot read. `custom_ids` replaces the custom_id of a location in
+    # bulk answers, None drops it. A bulk_status other than 200 fails every bulk
+    # request
+    def __init__(self, errors=(), missing=(), bad=(), custom_ids=(), bulk_status=200):
+        self.errors = set(errors)
+        self.missing = set(missing)
+        self.bad = set(bad)
+        self.custom_ids = dict(custom_ids)
+        self.bulk_status = bulk_status
+        self.requests = []
+
+    def __call__(self, request):
+        location = request.url.params["q"]
+        if location == "bulk":
+            queries = json.loads(request.content)["locations"]
+            self.requests.append(("bulk", [query["q"] for query in queries]))
+            if self.bulk_status != 200:
+                return httpx.Response(self.bulk_status, json={"error": NOT_FOUND})
+            # Answers come back in any order, custom_id tells them apart
+            items = [
+                {"query": self.bulk_answer(query)}
+                for query in reversed(queries)
+                if query["q"] not in self.missing
+            ]
+            return httpx.Response(200, json={"bulk": items})
+        self.requests.append(("single", location))
+        if location in self.errors:
+            return httpx.Response(400, json={"error": NOT_FOUND})
+        return httpx.Response(200, json=self.answer(location))
+
+    def bulk_answer(self, query):
+        answer = query | self.answer(query["q"])
+        if query["q"] in self.custom_ids:
+            custom_id = self.custom_ids[query["q"]]
+            if custom_id is None:
+                del answer["custom_id"]
+            else:
+                answer["custom_id"] = custom_id
+        return answer
+
+    def answer(self, location):
+        if location in self.errors:
+            return {"error": NOT_FOUND}
+        data = response(location)
+        if location in self.bad:
+            data["current"]["last_updated"] = "2026-10-18T12:15"
+        return data
+
+
+def fetch_and_save(stub, locations):
+    async def run():
+        async with WeatherApi(
+            "key", retries=0, transport=httpx.MockTransport(stub)
+        ) as api:
+            await api.fetch_and_save_bulk_weather(locations, "forecast")
+
+    asyncio.run(run())
+
+
+def saved(locations):
+    with Session(engine) as db:
+        return set(
+            db.scalars(
+                select(Location.name)
+                .join(CurrentWeather, CurrentWeather.location_id == Location.id)
+                .where(Location.name.in_(locations))
+            )
+        )
+
+
+def test_bulk_answers_are_matched_by_custom_id():
+    async def run():
+        async with WeatherApi(
+            "key", retries=0, transport=httpx.MockTransport(StubApi())
+        ) as api:
+            return await api.fetch_bulk_weather(["Oslo", "Lima", "Pune"], "forecast")
+
+    results = asyncio.run(run())
+    assert {location: data.location.name for location, data in results.items()} == {
+        "Oslo": "Oslo",
+        "Lima": "Lima",
+        "Pune": "Pune",
+    }
+
+
+def test_bulk_request_saves_every_location():
+    stub = StubApi()
+    fetch_and_save(stub, ["Bern", "Kyiv", "Riga"])
+    assert stub.requests == [("bulk", ["Bern", "Kyiv", "Riga"])]
+    assert saved(["Bern", "Kyiv", "Riga"]) == {"Bern", "Kyiv", "Riga"}
+
+
+def test_failed_bulk_items_are_fetched_on_their_own():
+    stub = StubApi(errors=["Nowhere"], missing=["Baku"])
+    fetch_and_save(stub, ["Doha", "Nowhere", "Baku"])
+    assert stub.requests == [
+        ("bulk", ["Doha", "Nowhere", "Baku"]),
+        ("single", "Nowhere"),
+        ("single", "Baku"),
+    ]
+    assert saved(["Doha", "Nowhere", "Baku"]) == {"Doha", "Baku"}
+
+
+def test_failed_bulk_request_falls_back_to_single_requests():
+    stub = StubApi(bulk_status=500)
+    fetch_and_save(stub, ["Rome", "Oran"])
+    assert stub.requests == [
+        ("bulk", ["Rome", "Oran"]),
+        ("single", "Rome"),
+        ("single", "Oran"),
+    ]
+    assert saved(["Rome", "Oran"]) == {"Rome", "Oran"}
+
+
+def test_unreadable_response_is_not_saved():
+    stub = StubApi(bad=["Suva"])
+    fetch_and_save(stub, ["Suva", "Apia"])
+    assert stub.requests == [("bulk", ["Suva", "Apia"]), ("single", "Suva")]
+    assert saved(["Suva", "Apia"]) == {"Apia"}
+
+
+def test_bulk_answers_with_unknown_custom_id_are_fetched_on_their_own():
+    stub = StubApi(custom_ids={"Hilo": None, "Nuuk": "7", "Male": "-1", "Ghat": "x"})
+    locations = ["Hilo", "Nuuk", "Male", "Ghat", "Kobe"]
+    fetch_and_save(stub, locations)
+    assert stub.requests == [
+        ("bulk", locations),
+        ("single", "Hilo"),
+        ("single", "Nuuk"),
+        ("single", "Male"),
+        ("single", "Ghat"),
+    ]
+    assert saved(locations) == set(locations)